@@ -0,0 +1,322 @@
+import re
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+
+# Aggregation engine =========================================
+# ============================================================
+# All statistics are computed on one C-contiguous float64 matrix (n_rows x n_columns)
+# The rows are sorted by group once, so every group is a contiguous block of rows
+# Each statistic is a vectorized reduction over these blocks (np.add.reduceat, np.fmin.reduceat, ...)
+# for all groups and all columns at the same time
+# Shared intermediate results (count, sum, mean, sorted values) are cached, so asking for more statistics
+# reuses them instead of scanning the data again
+# Missing or non-numeric values are ignored (they are only counted by null_count)
+
+# Statistic name -> function(GroupedMatrix) returning an (n_groups x n_columns) array
+STATISTICS = {}
+
+# Statistics that are whole numbers
+COUNT_STATISTICS = {"count", "null_count"}
+
+# Quantiles can be asked for as p0 ... p100, e.g. p90
+_PERCENTILE = re.compile(r"^p(\d{1,3}(?:\.\d+)?)$")
+
+
+def statistic(name):
+    def register(func):
+        STATISTICS[name] = func
+        return func
+    return register
+
+
+# The value columns as one C-contiguous float64 matrix (n_rows x n_columns), missing values are NaN
+def value_matrix(df, value_columns):
+    values = df[value_columns].apply(pd.to_numeric, errors="coerce").astype(float)
+    return np.ascontiguousarray(values.to_numpy(dtype=np.float64, na_value=np.nan))
+
+
+class GroupedMatrix:
+    # codes[i] is the group of row i (0 .. n_groups-1), every group must have at least one row
+    def __init__(self, matrix, codes, n_groups):
+        self.order = np.argsort(codes, kind="stable")
+        self.codes = codes[self.order]
+        self.matrix = np.ascontiguousarray(matrix[self.order])
+        self.starts = np.searchsorted(self.codes, np.arange(n_groups))
+        self.ends = np.append(self.starts[1:], len(self.codes))
+
+    def reduce(self, ufunc, values):
+        return ufunc.reduceat(values, self.starts, axis=0)
+
+    @cached_property
+    def missing(self):
+        return np.isnan(self.matrix)
+
+    @cached_property
+    def filled(self):
+        return np.where(self.missing, 0.0, self.matrix)
+
+    @cached_property
+    def count(self):
+        return self.reduce(np.add, (~self.missing).astype(np.int64))
+
+    @cached_property
+    def sum(self):
+        return self.reduce(np.add, self.filled)
+
+    @cached_property
+    def mean(self):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.sum / self.count
+
+    # Cumulative sums down every column, with one leading row of zeros
+    # The sum of the rows a .. b-1 is prefix[b] - prefix[a], so the sum of a group costs two row reads
+    @cached_property
+    def prefix_sums(self):
+        prefix = np.zeros((len(self.matrix) + 1, self.matrix.shape[1]))
+        np.cumsum(self.filled, axis=0, out=prefix[1:])
+        return prefix
+
+    # Same as prefix_sums for the number of values that are not missing
+    @cached_property
+    def prefix_counts(self):
+        prefix = np.zeros((len(self.matrix) + 1, self.matrix.shape[1]), dtype=np.int64)
+        np.cumsum(~self.missing, axis=0, out=prefix[1:])
+        return prefix
+
+    # Sum / count of the given columns for one group (or an array of groups) in O(1)
+    def group_sum(self, group, columns=slice(None)):
+        return self.prefix_sums[self.ends[group], columns] - self.prefix_sums[self.starts[group], columns]
+
+    def group_count(self, group, columns=slice(None)):
+        return self.prefix_counts[self.ends[group], columns] - self.prefix_counts[self.starts[group], columns]
+
+    # Values sorted inside each group, NaN last (used by the quantiles)
+    @cached_property
+    def sorted_values(self):
+        sorted_columns = []
+        for col in range(self.matrix.shape[1]):
+            order = np.lexsort((self.matrix[:, col], self.codes))
+            sorted_columns.append(self.matrix[order, col])
+        return np.column_stack(sorted_columns) if sorted_columns else self.matrix
+
+    # Linear interpolation between the closest ranks, the same as np.nanquantile
+    def quantile(self, q):
+        count = self.count
+        position = q * np.maximum(count - 1, 0)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, np.maximum(count - 1, 0))
+        base = self.starts[:, None]
+        columns = np.arange(self.matrix.shape[1])[None, :]
+        low_values = self.sorted_values[base + lower, columns]
+        high_values = self.sorted_values[base + upper, columns]
+        result = low_values + (high_values - low_values) * (position - lower)
+        return np.where(count > 0, result, np.nan)
+
+
+@statistic("count")
+def _count(grouped):
+    return grouped.count
+
+
+@statistic("null_count")
+def _null_count(grouped):
+    return grouped.reduce(np.add, grouped.missing.astype(np.int64))
+
+
+@statistic("sum")
+def _sum(grouped):
+    return grouped.sum
+
+
+@statistic("mean")
+def _mean(grouped):
+    return grouped.mean
+
+
+# Sample standard deviation (ddof=1), computed from the deviations to the group mean
+@statistic("std")
+def _std(grouped):
+    deviations = np.where(grouped.missing, 0.0, grouped.matrix - grouped.mean[grouped.codes])
+    squares = grouped.reduce(np.add, deviations * deviations)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(grouped.count > 1, np.sqrt(squares / (grouped.count - 1)), np.nan)
+
+
+@statistic("min")
+def _min(grouped):
+    return grouped.reduce(np.fmin, grouped.matrix)
+
+
+@statistic("max")
+def _max(grouped):
+    return grouped.reduce(np.fmax, grouped.matrix)
+
+
+@statistic("median")
+def _median(grouped):
+    return grouped.quantile(0.5)
+
+
+def is_statistic(name):
+    match = _PERCENTILE.match(name)
+    return name in STATISTICS or (match is not None and float(match.group(1)) <= 100)
+
+
+def compute_statistic(grouped, name):
+    if name in STATISTICS:
+        return STATISTICS[name](grouped)
+    match = _PERCENTILE.match(name)
+    if match is None or float(match.group(1)) > 100:
+        raise ValueError(f"Unknown statistic '{name}'")
+    return grouped.quantile(float(match.group(1)) / 100)
+
+
+# Group codes (0 .. n_groups-1) for every row and the distinct group values, in order of first appearance
+# Without group_column all rows are one group, rows without a group value get code -1
+def factorize_groups(df, group_column=None, normalize=None):
+    if group_column is None:
+        return np.zeros(len(df), dtype=np.intp), [None] if len(df) else []
+    keys = df[group_column].astype(object)
+    if normalize is not None:
+        keys = keys.map(normalize, na_action="ignore")
+    codes, groups = pd.factorize(keys)
+    return codes, list(groups)
+
+
+# Compute the requested statistics of value_columns for every group of group_column
+# Rows without a group value are left out
+# Returns (group values, {statistic: (n_groups x n_columns) array})
+def aggregate(df, value_columns, stats, group_column=None, normalize=None):
+    if group_column is not None:
+        df = df[df[group_column].notna()]
+    codes, groups = factorize_groups(df, group_column, normalize)
+    if not groups:
+        return [], {name: np.empty((0, len(value_columns))) for name in stats}
+
+    grouped = GroupedMatrix(value_matrix(df, value_columns), codes, len(groups))
+    return groups, {name: compute_statistic(grouped, name) for name in stats}
+
+
+# Impact matrix =========================================
+# =======================================================
+# All impact columns of the dataset as one C-contiguous float64 matrix (n_rows x n_impacts)
+# The rows are permuted so that every country is one contiguous block of rows
+# Together with the prefix sums of every column, the sum of any country (or any block of countries) costs
+# two row reads instead of a pass over the rows, and bulk reductions run over contiguous memory
+# Rows without a country are kept in one extra block at the end
+class ImpactMatrix:
+    def __init__(self, df, impacts, key_column, normalize):
+        self.impacts = impacts
+        self.columns = [impact.column for impact in impacts]
+        self.positions = {column: j for j, column in enumerate(self.columns)}
+
+        codes, self.keys = factorize_groups(df, key_column, normalize)
+        self.group_ids = {key: i for i, key in enumerate(self.keys)}
+        n_groups = len(self.keys)
+        if (codes < 0).any():
+            codes = np.where(codes < 0, n_groups, codes)
+            n_groups += 1
+
+        self.grouped = GroupedMatrix(value_matrix(df, self.columns), codes, n_groups)
+        # Build the prefix sums now, so the first request does not pay for them
+        self.grouped.prefix_sums
+        self.grouped.prefix_counts
+
+    def has_columns(self, columns):
+        return all(column in self.positions for column in columns)
+
+    # sum / count / null_count / mean of the given columns for one group key, from the prefix sums
+    # Returns None if the key is unknown
+    def group_statistics(self, key, columns, stats):
+        group = self.group_ids.get(key)
+        if group is None:
+            return None
+        positions = [self.positions[column] for column in columns]
+        sums = self.grouped.group_sum(group, positions)
+        counts = self.grouped.group_count(group, positions)
+        size = self.grouped.ends[group] - self.grouped.starts[group]
+        results = {}
+        for name in stats:
+            if name == "sum":
+                results[name] = sums
+            elif name == "count":
+                results[name] = counts
+            elif name == "null_count":
+                results[name] = size - counts
+            elif name == "mean":
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    results[name] = sums / counts
+            else:
+                raise ValueError(f"Statistic '{name}' is not available from prefix sums")
+        return results
+
+
+# Statistics that group_statistics() can answer from the prefix sums
+PREFIX_STATISTICS = {"sum", "count", "null_count", "mean"}
+
+
+# Materialized GWP aggregates =========================================
+# =====================================================================
+# The GWP aggregates per country only depend on the dataset, so they are computed once per dataset version
+# The GWP columns are found by the impact registry (see app/impacts.py)
+# The per-country sums are read from the prefix sums of the impact matrix, the routes only do a dict lookup
+# Missing or non-numeric GWP values count as 0, the same as to_numeric(errors="coerce").fillna(0)
+
+# Build {normalized key: aggregate} for every group of the impact matrix
+# Each aggregate holds the group code and name, the sum of every value column (by_column),
+# the total of these sums and the smallest / largest column sum
+def build_group_aggregates(matrix, df, key_column, name_column, value_columns):
+    n_keys = len(matrix.keys)
+    if n_keys == 0:
+        return {}
+
+    groups = np.arange(n_keys)
+    grouped = matrix.grouped
+    sums = grouped.group_sum(groups[:, None], [matrix.positions[column] for column in value_columns])
+
+    # The code and name of a group are taken from its first row
+    first_rows = grouped.order[grouped.starts[:n_keys]]
+    first_codes = df[key_column].astype(object).to_numpy()[first_rows]
+    first_names = df[name_column].astype(object).to_numpy()[first_rows]
+
+    table = {}
+    for key, code, name, row in zip(matrix.keys, first_codes, first_names, sums.tolist()):
+        by_column = dict(zip(value_columns, row))
+        table[key] = {
+            "code": code,
+            "name": name,
+            "by_column": by_column,
+            "total": sum(by_column.values()),
+            "min": min(by_column.values()),
+            "max": max(by_column.values()),
+        }
+    return table
+
+
+# All-groups leaderboard =========================================
+# ================================================================
+# Ranks all groups of an aggregate table (e.g. all countries) by one field
+# The sorted order of a field is computed the first time it is asked for and then reused,
+# the table belongs to one dataset version, so the sorted orders are cached per version
+class Leaderboard:
+    def __init__(self, table):
+        self.entries = list(table.values())
+        self._orders = {}
+
+    def ranked(self, sort="total", descending=True, limit=None, offset=0):
+        order = self._orders.get(sort)
+        if order is None:
+            # Ascending by the field, ties broken by code so the order is stable
+            if sort in ("name", "code"):
+                key = lambda entry: (str(entry[sort]).casefold(), str(entry["code"]))
+            else:
+                key = lambda entry: (entry[sort], str(entry["code"]))
+            order = sorted(self.entries, key=key)
+            self._orders[sort] = order
+        if descending:
+            order = order[::-1]
+        stop = None if limit is None else offset + limit
+        return order[offset:stop]
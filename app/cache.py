@@ -0,0 +1,336 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode
+
+from starlette.concurrency import run_in_threadpool
+
+from .encoding import negotiate
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, without it only gzip variants are kept
+    brotli = None
+
+
+# Response cache =========================================
+# ========================================================
+# The API only reads the dataset, so the response of a GET request only depends on the route, the query parameters
+# and the dataset version (the content hash of the Excel file)
+# Successful responses are kept in memory under that key, a repeated request is answered from the cache
+# without running the route (no pandas, no encoding)
+# The cache has a byte budget, the least recently used responses are dropped first when it is full
+# When the dataset version changes the whole cache is dropped, so an old response is never served
+
+DEFAULT_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_BYTES", 64 * 1024 * 1024))
+
+
+# headers are the response headers without content-length
+# variants are the compressed bodies by content coding, e.g. {"gzip": ..., "br": ...}
+class CachedResponse:
+    def __init__(self, status, headers, body, variants=None):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.variants = variants or {}
+        self.size = (
+            len(body)
+            + sum(len(variant) for variant in self.variants.values())
+            + sum(len(name) + len(value) for name, value in headers)
+        )
+
+    # (content coding, body) of the first accepted coding that has a variant, (None, body) if there is none
+    def select(self, encodings):
+        for encoding in encodings:
+            if encoding in self.variants:
+                return encoding, self.variants[encoding]
+        return None, self.body
+
+
+class ResponseCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_entry_bytes=None):
+        self.max_bytes = max_bytes
+        # A single response may use at most a quarter of the budget, bigger ones are not cached
+        self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes // 4
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.n_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Drop all entries if the dataset version has changed
+    def set_version(self, version):
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.n_bytes = 0
+                self.version = version
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    # key[0] is the dataset version, responses of an older version are not kept
+    def put(self, key, entry):
+        if entry.size > self.max_entry_bytes:
+            return
+        with self._lock:
+            if key[0] != self.version:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.n_bytes -= old.size
+            self._entries[key] = entry
+            self.n_bytes += entry.size
+            while self.n_bytes > self.max_bytes:
+                _, dropped = self._entries.popitem(last=False)
+                self.n_bytes -= dropped.size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.n_bytes = 0
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "entries": len(self._entries),
+            "bytes": self.n_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# Query parameters in sorted order, so ?a=1&b=2 and ?b=2&a=1 share one entry
+def normalize_query(query_string):
+    return urlencode(sorted(parse_qsl(query_string.decode("latin-1"), keep_blank_values=True)))
+
+
+# Precompressed bodies =========================================
+# ==============================================================
+# When a response is cached, gzip and brotli variants of its body are compressed once and cached with it
+# A request then gets the variant that matches its Accept-Encoding header, nothing is compressed per request
+# Bodies smaller than COMPRESS_MIN_BYTES are not compressed, a variant that is not smaller than the body is not kept
+# Every variant has its own ETag (the ETag of the body with the coding added) and Vary: Accept-Encoding is sent
+COMPRESS_MIN_BYTES = 1024
+# Content codings in the order the server prefers them
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def compress(body):
+    if len(body) < COMPRESS_MIN_BYTES:
+        return {}
+    variants = {"gzip": gzip.compress(body, compresslevel=6, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(body, quality=9)
+    return {encoding: variant for encoding, variant in variants.items() if len(variant) < len(body)}
+
+
+# Accepted codings of an Accept-Encoding header (e.g. b"gzip, br;q=0.9"), best first
+def accepted_encodings(accept_encoding):
+    weights = {}
+    for part in accept_encoding.decode("latin-1").split(","):
+        coding, _, params = part.strip().partition(";")
+        if not coding:
+            continue
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding.strip().lower()] = weight
+    default = weights.get("*", 0.0)
+    ranked = [(weights.get(encoding, default), -i, encoding) for i, encoding in enumerate(ENCODINGS)]
+    return [encoding for weight, _, encoding in sorted(ranked, reverse=True) if weight > 0]
+
+
+def variant_etag(etag, encoding):
+    return etag[:-1] + b"-" + encoding.encode("latin-1") + b'"' if encoding else etag
+
+
+# Conditional requests =========================================
+# ==============================================================
+# A response only depends on the dataset version, the path, the query parameters and the negotiated encoding,
+# so its ETag is derived from them and known before the route runs
+# A client that sends the ETag back in If-None-Match gets "304 Not Modified" without a body
+# as long as the dataset has not changed, the route is not run for it
+# Cache-Control "no-cache" lets clients and proxies keep the response but ask again (cheap with the ETag)
+#
+# Dataset-versioned URLs: /v/{version}/<path> is the same as /<path> for that dataset version
+# (e.g. /v/5bd0c4c2.../data/country/DE), the current version is sent in the X-Dataset-Version header
+# The content of such a URL never changes, so it is sent with an immutable Cache-Control
+# A version that is not the current one returns 404
+VERSIONED_PATH = re.compile(r"^/v/(?P<version>[0-9a-fA-F]+)(?P<path>/.*)$")
+CACHE_CONTROL = b"public, no-cache"
+IMMUTABLE_CACHE_CONTROL = b"public, max-age=31536000, immutable"
+
+
+# media_type is the encoding negotiated from the Accept header (see app/encoding.py)
+def make_etag(version, path, query, media_type):
+    digest = hashlib.sha256(f"{path}?{query} {media_type}".encode("utf-8")).hexdigest()
+    return f'"{version[:16]}-{digest[:16]}"'.encode("latin-1")
+
+
+# If-None-Match holds a list of ETags, weak ETags (W/"...") match as well
+# "*" is not treated as a match, the middleware cannot tell if the route would answer 200 without running it
+# Returns the first of etags that matches, or None
+def matching_etag(if_none_match, etags):
+    tags = [tag.strip() for tag in if_none_match.split(b",")]
+    tags = [tag[2:] if tag.startswith(b"W/") else tag for tag in tags]
+    return next((etag for etag in etags if etag in tags), None)
+
+
+# ASGI middleware for GET requests: versioned URLs, ETag / 304 responses and the ResponseCache
+# version() returns the current dataset version, it is called in a worker thread because it checks the file
+# Requests are passed through if version() fails (e.g. the file is missing), the route reports the error instead
+# Only 200 responses are cached, the X-Cache header tells if a response came from the cache (HIT) or not (MISS)
+class ResponseCacheMiddleware:
+    def __init__(self, app, cache, version, exclude=()):
+        self.app = app
+        self.cache = cache
+        self.version = version
+        self.exclude = tuple(exclude)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET" or scope["path"].startswith(self.exclude):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            version = await run_in_threadpool(self.version)
+        except Exception:
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        cache_control = CACHE_CONTROL
+        versioned = VERSIONED_PATH.match(path)
+        if versioned is not None:
+            if versioned.group("version").lower() != version:
+                detail = f"Dataset version {versioned.group('version')} is not available, the current version is {version}"
+                await self.send_json(send, 404, {"detail": detail}, [(b"x-dataset-version", version.encode("latin-1"))])
+                return
+            path = versioned.group("path")
+            scope = {**scope, "path": path, "raw_path": path.encode("utf-8")}
+            cache_control = IMMUTABLE_CACHE_CONTROL
+            if path.startswith(self.exclude):
+                await self.app(scope, receive, send)
+                return
+
+        query = normalize_query(scope.get("query_string", b""))
+        headers = dict(scope["headers"])
+        # Routes with rows answer in the encoding asked for in Accept (JSON, MessagePack, CBOR),
+        # so the negotiated media type is part of the ETag and of the cache key
+        media_type = negotiate(headers.get(b"accept", b"").decode("latin-1")).media_type
+        etag = make_etag(version, path, query, media_type)
+        encodings = accepted_encodings(headers.get(b"accept-encoding", b""))
+
+        def validators(encoding=None):
+            return [
+                (b"etag", variant_etag(etag, encoding)),
+                (b"cache-control", cache_control),
+                (b"vary", b"Accept, Accept-Encoding"),
+                (b"x-dataset-version", version.encode("latin-1")),
+            ]
+
+        if_none_match = headers.get(b"if-none-match")
+        if if_none_match is not None:
+            matched = matching_etag(if_none_match, [variant_etag(etag, encoding) for encoding in (None,) + ENCODINGS])
+            if matched is not None:
+                not_modified = [(name, matched if name == b"etag" else value) for name, value in validators()]
+                await send({"type": "http.response.start", "status": 304, "headers": not_modified})
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        self.cache.set_version(version)
+        key = (version, path, query, media_type)
+        entry = self.cache.get(key)
+        if entry is not None:
+            await self.send_entry(send, entry, encodings, validators, b"HIT")
+            return
+
+        # A single-body 200 response is cached first and then sent like a hit, so it is already compressed
+        # Streamed responses are passed through as they are and kept (with their variants) when they are complete
+        start = {}
+        chunks = []
+        size = 0
+
+        async def send_and_keep(message):
+            nonlocal size
+            if message["type"] == "http.response.start":
+                start.update(message)
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            status = start["status"]
+            cacheable = status == 200 and not any(name.lower() == b"content-encoding" for name, _ in start.get("headers", []))
+            if cacheable and not chunks and not more_body and "sent" not in start:
+                if len(body) <= self.cache.max_entry_bytes:
+                    entry = await self.keep(key, start, body)
+                    await self.send_entry(send, entry, encodings, validators, b"MISS")
+                    return
+
+            if "sent" not in start:
+                start["sent"] = True
+                headers = list(start.get("headers", []))
+                if status == 200:
+                    headers += validators()
+                await send({"type": "http.response.start", "status": status, "headers": headers + [(b"x-cache", b"MISS")]})
+
+            # Kept before the last chunk is sent, a StreamingResponse is cancelled when the client disconnects after it
+            if cacheable:
+                size += len(body)
+                if size <= self.cache.max_entry_bytes:
+                    chunks.append(body)
+                    if not more_body:
+                        await self.keep(key, start, b"".join(chunks))
+            await send(message)
+
+        await self.app(scope, receive, send_and_keep)
+
+    async def send_entry(self, send, entry, encodings, validators, cache_status):
+        encoding, body = entry.select(encodings)
+        headers = entry.headers + validators(encoding) + [(b"x-cache", cache_status)]
+        if encoding is not None:
+            headers.append((b"content-encoding", encoding.encode("latin-1")))
+        headers.append((b"content-length", str(len(body)).encode("latin-1")))
+        await send({"type": "http.response.start", "status": entry.status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    async def send_json(self, send, status, content, headers):
+        body = json.dumps(content).encode("utf-8")
+        headers = headers + [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode("latin-1"))]
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    # Compress the body (in a worker thread, not on the event loop) and put the response into the cache
+    async def keep(self, key, start, body):
+        headers = [(name, value) for name, value in start.get("headers", []) if name.lower() != b"content-length"]
+        variants = await run_in_threadpool(compress, body)
+        entry = CachedResponse(start["status"], headers, body, variants)
+        self.cache.put(key, entry)
+        return entry
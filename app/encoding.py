@@ -0,0 +1,175 @@
+import json
+import struct
+
+from fastapi.encoders import jsonable_encoder
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, without it the standard json module is used
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional, without it MessagePack is not offered
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # cbor2 is optional, without it CBOR is not offered
+    cbor2 = None
+
+
+# JSON encoding =========================================
+# =======================================================
+# dumps() returns compact UTF-8 JSON bytes, with orjson if it is installed
+
+def dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value)
+    # Same settings as fastapi.responses.JSONResponse
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+# Response encodings =========================================
+# ============================================================
+# Rows can be sent as JSON (default), MessagePack or CBOR, chosen by the Accept header of the request
+# An encoding encodes single values and frames already encoded items into arrays and maps,
+# so cached row bytes can be joined into a response without decoding them again
+# iter_array() / iter_map() yield the bytes in pieces, so they can be streamed
+class JSONEncoding:
+    media_type = "application/json"
+
+    def encode(self, value):
+        return dumps(value)
+
+    # n_items is the number of items, chunks yields lists of encoded items
+    def iter_array(self, n_items, chunks):
+        yield b"["
+        first = True
+        for items in chunks:
+            if items:
+                yield (b"" if first else b",") + b",".join(items)
+                first = False
+        yield b"]"
+
+    # fields is a list of (key, chunks of encoded value bytes)
+    def iter_map(self, fields):
+        yield b"{"
+        for i, (key, value) in enumerate(fields):
+            yield (b"," if i else b"") + self.encode(key) + b":"
+            yield from value
+        yield b"}"
+
+
+# Binary encodings start an array or map with its number of items, the items follow without separators
+class BinaryEncoding:
+    def iter_array(self, n_items, chunks):
+        yield self.array_header(n_items)
+        for items in chunks:
+            yield b"".join(items)
+
+    def iter_map(self, fields):
+        yield self.map_header(len(fields))
+        for key, value in fields:
+            yield self.encode(key)
+            yield from value
+
+
+class MessagePackEncoding(BinaryEncoding):
+    media_type = "application/msgpack"
+
+    def encode(self, value):
+        return msgpack.packb(value, use_bin_type=True)
+
+    def array_header(self, n):
+        if n < 16:
+            return bytes([0x90 | n])
+        return struct.pack(">BH", 0xDC, n) if n < 1 << 16 else struct.pack(">BI", 0xDD, n)
+
+    def map_header(self, n):
+        if n < 16:
+            return bytes([0x80 | n])
+        return struct.pack(">BH", 0xDE, n) if n < 1 << 16 else struct.pack(">BI", 0xDF, n)
+
+
+class CBOREncoding(BinaryEncoding):
+    media_type = "application/cbor"
+
+    def encode(self, value):
+        return cbor2.dumps(value)
+
+    # Major type (4 = array, 5 = map) with the length as argument
+    @staticmethod
+    def header(major, n):
+        if n < 24:
+            return bytes([major << 5 | n])
+        if n < 1 << 8:
+            return struct.pack(">BB", major << 5 | 24, n)
+        if n < 1 << 16:
+            return struct.pack(">BH", major << 5 | 25, n)
+        return struct.pack(">BI", major << 5 | 26, n)
+
+    def array_header(self, n):
+        return self.header(4, n)
+
+    def map_header(self, n):
+        return self.header(5, n)
+
+
+JSON = JSONEncoding()
+
+# Media type -> encoding, only the encodings whose package is installed
+ENCODINGS = {JSON.media_type: JSON}
+if msgpack is not None:
+    ENCODINGS["application/msgpack"] = ENCODINGS["application/x-msgpack"] = MessagePackEncoding()
+if cbor2 is not None:
+    ENCODINGS["application/cbor"] = CBOREncoding()
+
+
+# The encoding for an Accept header, e.g. "application/msgpack, application/json;q=0.5"
+# The accepted media type with the highest q wins, JSON on a tie, and JSON if nothing else is accepted
+def negotiate(accept):
+    if not accept:
+        return JSON
+    best, best_weight = JSON, 0.0
+    for part in accept.split(","):
+        media_type, _, params = part.strip().partition(";")
+        encoding = ENCODINGS.get(media_type.strip().lower())
+        if encoding is None:
+            continue
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if weight > best_weight or (weight == best_weight and encoding is JSON):
+            best, best_weight = encoding, weight
+    return best
+
+
+# Pre-serialized rows =========================================
+# =============================================================
+# The rows of a dataset version never change, so every row is encoded once (JSON when the dataset is loaded,
+# the other encodings the first time they are asked for)
+# A response with rows is then only a join of the cached bytes of its rows, e.g. b"[" + b",".join(rows) + b"]"
+# No dicts are built and nothing is encoded per request
+class RowBytes:
+    def __init__(self, df, encoding=JSON, chunk_rows=5000):
+        self.encoding = encoding
+        self.rows = []
+        for start in range(0, len(df), chunk_rows):
+            records = jsonable_encoder(df.iloc[start:start + chunk_rows].to_dict(orient="records"))
+            self.rows.extend(encoding.encode(record) for record in records)
+        self.n_bytes = sum(len(row) for row in self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    # Array of the given rows in chunks of chunk_rows rows
+    def iter_array(self, positions, chunk_rows=500):
+        rows = self.rows
+        chunks = ([rows[i] for i in positions[start:start + chunk_rows]] for start in range(0, len(positions), chunk_rows))
+        return self.encoding.iter_array(len(positions), chunks)
@@ -0,0 +1,85 @@
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional, without it the export routes return 501
+    pa = None
+    pq = None
+
+
+# Arrow / Parquet export =========================================
+# ================================================================
+# Analytics clients can load the rows as an Arrow IPC stream or a Parquet file instead of JSON
+# The rows are taken from the in-memory DataFrame in batches of EXPORT_BATCH_ROWS rows and converted to Arrow
+# record batches column by column (numeric columns without copying, categorical columns as dictionaries),
+# no Python dicts are built
+# Every batch is written and sent before the next one is converted, so a big export does not sit in memory
+# The Arrow stream can be read zero-copy, e.g. pyarrow.ipc.open_stream(body).read_all() or polars.read_ipc_stream
+
+EXPORT_AVAILABLE = pa is not None
+EXPORT_BATCH_ROWS = 10000
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+
+
+# Write-only file that hands out what was written since the last take()
+# tell() counts all bytes written, the Parquet writer needs it for the offsets in the footer
+class ChunkSink:
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def export_schema(df):
+    return pa.Schema.from_pandas(df.iloc[:0], preserve_index=False)
+
+
+# Record batches of the given rows and columns (all columns if columns is None) of the dataset
+def iter_batches(dataset, positions, columns, schema, batch_rows=EXPORT_BATCH_ROWS):
+    for start in range(0, len(positions), batch_rows):
+        rows = dataset.rows(positions[start:start + batch_rows], columns)
+        yield pa.RecordBatch.from_pandas(rows, schema=schema, preserve_index=False)
+
+
+def iter_export(dataset, positions, columns, open_writer):
+    df = dataset.df if columns is None else dataset.df[columns]
+    schema = export_schema(df)
+    sink = ChunkSink()
+    writer = open_writer(pa.PythonFile(sink, mode="w"), schema)
+    for batch in iter_batches(dataset, positions, columns, schema):
+        writer.write_batch(batch)
+        data = sink.take()
+        if data:
+            yield data
+    writer.close()
+    yield sink.take()
+
+
+# Arrow IPC stream format, one message per record batch
+def iter_arrow_stream(dataset, positions, columns=None):
+    return iter_export(dataset, positions, columns, pa.ipc.new_stream)
+
+
+# Parquet file, one row group per record batch, the footer is sent last
+def iter_parquet(dataset, positions, columns=None):
+    return iter_export(dataset, positions, columns, pq.ParquetWriter)
@@ -0,0 +1,105 @@
+import os
+import re
+from typing import NamedTuple, Optional
+
+
+# Impact category registry =========================================
+# ==================================================================
+# Impact columns have long headers like
+#   "Carbon Minds ISO 14067 (based on IPCC 2021) - climate change: fossil - global warming potential (GWP100) [kg CO2-Eq]"
+# which are "<method> - <category>[: <sub-category>] - <indicator> [<unit>]"
+# When the dataset is loaded every header is parsed once into an Impact with a short id (e.g. climate_change_fossil_gwp100)
+# and the position of its column, so routes can use the short id instead of the long header
+# One method is the default (IMPACT_METHOD environment variable), its impacts have the plain short id and are the ones
+# used for indicator codes like GWP100 and the GWP aggregates
+# Impacts of other methods get the method in their id (e.g. ef_3_1_climate_change_gwp100), so adding a method to the
+# dataset does not change the ids of the existing impacts
+
+DEFAULT_METHOD = os.environ.get("IMPACT_METHOD", "Carbon Minds ISO 14067 (based on IPCC 2021)")
+
+IMPACT_HEADER = re.compile(
+    r"^(?P<method>.+?) - (?P<category>[^:]+?)(?:: (?P<sub_category>.+?))? - (?P<indicator>.+?)\s*\[(?P<unit>[^\]]+)\]$"
+)
+
+# Abbreviation at the end of the indicator, e.g. "global warming potential (GWP100)" -> "GWP100"
+INDICATOR_CODE = re.compile(r"\(([^()]+)\)\s*$")
+
+
+class Impact(NamedTuple):
+    id: str
+    column: str
+    position: int
+    method: str
+    category: str
+    sub_category: Optional[str]
+    indicator: str
+    indicator_code: Optional[str]
+    unit: str
+
+
+def slug(text):
+    return re.sub(r"[^0-9a-z]+", "_", text.casefold()).strip("_")
+
+
+# Parse one column header, returns None if it is not an impact column
+def parse_impact_header(column, position):
+    match = IMPACT_HEADER.match(column.strip())
+    if match is None:
+        return None
+    parts = match.groupdict()
+    code = INDICATOR_CODE.search(parts["indicator"])
+    indicator_code = code.group(1) if code else None
+    impact_id = "_".join(
+        slug(part) for part in (parts["category"], parts["sub_category"], indicator_code or parts["indicator"]) if part
+    )
+    return Impact(
+        id=impact_id,
+        column=column,
+        position=position,
+        method=parts["method"],
+        category=parts["category"],
+        sub_category=parts["sub_category"],
+        indicator=parts["indicator"],
+        indicator_code=indicator_code,
+        unit=parts["unit"],
+    )
+
+
+class ImpactRegistry:
+    def __init__(self, columns, is_numeric=lambda column: True, method=DEFAULT_METHOD):
+        self.method = method
+        self.impacts = []
+        for position, column in enumerate(columns):
+            impact = parse_impact_header(str(column), position)
+            if impact is not None and is_numeric(column):
+                if not self.is_default(impact.method):
+                    impact = impact._replace(id=f"{slug(impact.method)}_{impact.id}")
+                self.impacts.append(impact)
+        self.by_id = {impact.id: impact for impact in self.impacts}
+
+    def __len__(self):
+        return len(self.impacts)
+
+    def get(self, impact_id):
+        return self.by_id.get(impact_id.casefold())
+
+    def is_default(self, method):
+        return method.casefold() == self.method.casefold()
+
+    # Impacts of the default method with the given indicator code (e.g. "GWP100"), in column order
+    def with_indicator(self, indicator_code):
+        code = indicator_code.casefold()
+        return [
+            impact for impact in self.impacts
+            if (impact.indicator_code or "").casefold() == code and self.is_default(impact.method)
+        ]
+
+    # Resolve a list of ids, raises KeyError with the first unknown id
+    def resolve(self, impact_ids):
+        impacts = []
+        for impact_id in impact_ids:
+            impact = self.get(impact_id)
+            if impact is None:
+                raise KeyError(impact_id)
+            impacts.append(impact)
+        return impacts
@@ -0,0 +1,127 @@
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+
+# Lookup indexes =========================================
+# =====================================================
+# Indexes are built once per dataset version (see Dataset in app/store.py) and never changed afterwards
+# A lookup is a dict hit that returns row positions, the rows are then taken with df.take(positions)
+# So a lookup no longer scans the whole column on every request
+
+EMPTY_ROWS = np.empty(0, dtype=np.intp)
+
+
+# Keys are compared case-insensitive, the same as the old .str.upper() / .str.lower() filters
+def normalize_key(value):
+    return str(value).casefold()
+
+
+# Map every normalized value of a column to the sorted positions of the rows that have it
+# Missing values are not indexed
+def build_value_index(series, normalize=normalize_key):
+    codes, uniques = pd.factorize(series)
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(-1, len(uniques)), side="right")
+
+    index = {}
+    for i, value in enumerate(uniques):
+        key = normalize(value)
+        rows = order[bounds[i]:bounds[i + 1]]
+        if key in index:
+            # Two spellings with the same normalized key, e.g. "de" and "DE"
+            rows = np.sort(np.concatenate([index[key], rows]))
+        rows.flags.writeable = False
+        index[key] = rows
+    return index
+
+
+# CAS registry numbers are compared without dashes and leading zeros, e.g. "000101-81-5" == "101815"
+def normalize_cas(value):
+    return str(value).strip().replace("-", "").lstrip("0")
+
+
+# Keys that point to more than one row, e.g. duplicated primary keys
+def duplicate_keys(index):
+    return sorted(key for key, rows in index.items() if len(rows) > 1)
+
+
+def lookup(index, value, normalize=normalize_key):
+    return index.get(normalize(value), EMPTY_ROWS)
+
+
+# Sorted prefix index over the distinct values of a column =========================================
+# ===================================================================================================
+# The normalized values are kept in one sorted list, all values with a given prefix are next to each other
+# bisect finds the first match in O(log n), then the matches are read in order until the prefix stops matching
+# So a prefix query costs O(log n + k) and never looks at the other values
+class PrefixIndex:
+    def __init__(self, values, normalize=normalize_key):
+        self.normalize = normalize
+        # Distinct values in the order they first appear in the data
+        self.values = list(values)
+        pairs = sorted((normalize(value), value) for value in self.values)
+        self.keys = [key for key, _ in pairs]
+        self.sorted_values = [value for _, value in pairs]
+
+    def search(self, prefix, limit=None):
+        prefix = self.normalize(prefix)
+        start = bisect_left(self.keys, prefix)
+        stop = len(self.keys) if limit is None else min(len(self.keys), start + limit)
+        matches = []
+        for i in range(start, stop):
+            if not self.keys[i].startswith(prefix):
+                break
+            matches.append(self.sorted_values[i])
+        return matches
+
+
+# N-gram index for substring (contains) search =========================================
+# =======================================================================================
+# Every distinct value is split into all its 1, 2 and 3 character grams
+# Each gram points to the sorted ids of the values that contain it (posting list)
+# Queries up to 3 characters are a single posting list lookup
+# Longer queries intersect the posting lists of their trigrams (shortest list first)
+# and only the few remaining candidates are checked with a real substring test
+class NGramIndex:
+    N = 3
+
+    def __init__(self, values, normalize=normalize_key):
+        self.normalize = normalize
+        pairs = sorted((normalize(value), value) for value in values)
+        self.keys = [key for key, _ in pairs]
+        self.sorted_values = [value for _, value in pairs]
+
+        postings = {}
+        for value_id, key in enumerate(self.keys):
+            grams = set()
+            for size in range(1, self.N + 1):
+                grams.update(key[i:i + size] for i in range(len(key) - size + 1))
+            for gram in grams:
+                postings.setdefault(gram, []).append(value_id)
+        self.postings = {gram: np.array(ids, dtype=np.intp) for gram, ids in postings.items()}
+
+    def search(self, query, limit=None):
+        query = self.normalize(query)
+        if not query:
+            candidates = np.arange(len(self.keys))
+        elif len(query) <= self.N:
+            candidates = self.postings.get(query, EMPTY_ROWS)
+        else:
+            grams = {query[i:i + self.N] for i in range(len(query) - self.N + 1)}
+            lists = sorted((self.postings.get(gram, EMPTY_ROWS) for gram in grams), key=len)
+            candidates = lists[0]
+            for ids in lists[1:]:
+                if len(candidates) == 0:
+                    break
+                candidates = np.intersect1d(candidates, ids, assume_unique=True)
+
+        matches = []
+        for value_id in candidates:
+            if len(query) > self.N and query not in self.keys[value_id]:
+                continue
+            matches.append(self.sorted_values[value_id])
+            if limit is not None and len(matches) >= limit:
+                break
+        return matches
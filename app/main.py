@@ -1,8 +1,44 @@
-from fastapi import FastAPI, HTTPException, Query, Depends
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional
+from fastapi import FastAPI, HTTPException, Query, Depends, Header, Response
+from fastapi.responses import StreamingResponse
+import numpy as np
 import pandas as pd
+import logging
 import os
+from urllib.parse import quote
+
+from .aggregates import COUNT_STATISTICS, PREFIX_STATISTICS, aggregate, is_statistic
+from .cache import ResponseCache, ResponseCacheMiddleware
+from .encoding import negotiate
+from .export import (
+    ARROW_MEDIA_TYPE,
+    EXPORT_AVAILABLE,
+    PARQUET_MEDIA_TYPE,
+    iter_arrow_stream,
+    iter_parquet,
+)
+from .indexes import normalize_key
+from .query import QueryError, compile_query
+from .snapshot import load_workbook
+from .store import Dataset, DatasetStore
+from .streaming import iter_document, iter_records
+
+logger = logging.getLogger(__name__)
+
+
+# Load the dataset when the server starts, so the first request does not pay for it
+# A missing or broken file does not stop the server, the routes report the error instead
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        store.get()
+    except Exception:
+        logger.exception("Could not preload dataset from %s", FILE_PATH)
+    yield
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Old_File path which shows error when running the tests
 # =====================================================
@@ -17,38 +53,46 @@ FILE_PATH = os.path.join(BASE_DIR, "..", "uploads", "TestData.xlsx")
 # This function will be called by other routes to access the data
 # =====================================================
 # =====================================================
-# Here we are using the openpyxl engine to read the Excel file
-# This is because the default engine (xlrd) does not support the latest Excel file format
-# The openpyxl engine is slower but more reliable for newer Excel files
-# The convert_dtypes() method is used to convert mixed data types to a single data type
-# This is useful for columns with mixed data types (e.g., float and int)
-# The RAND() values are replaced with fixed values to ensure consistent results
-# The data is returned as a DataFrame object
+# The Excel file is parsed by the DatasetStore (see app/store.py) the first time it is needed
+# If a columnar snapshot of the same file content exists (see app/snapshot.py) it is memory mapped instead
+# After that every request gets the same in-memory DataFrame, so the request no longer pays for parsing the file
+# The store checks the file on every call and reloads it only when the content has changed
+# get_dataset() returns the whole Dataset (DataFrame + version hash)
+# load_data() returns only the DataFrame, no route uses it any more
+# It is kept as a compatibility helper because the tests in tests/test_main.py patch server3.app.main.load_data
+# If the file is missing, an HTTP 404 error is raised
 # If an error occurs, an HTTP 500 error is raised with the error message
 
-def load_data():
-    if not os.path.exists(FILE_PATH):
-        raise HTTPException(status_code=404, detail="File not found in uploads folder")
+store = DatasetStore(FILE_PATH, reader=load_workbook)
 
-    try:
-        # Load the Excel file using the openpyxl engine
-        df = pd.read_excel(FILE_PATH, sheet_name=0, engine="openpyxl")
 
-        # Use strip() to remove leading/trailing or whitespaces from column names
-        df.columns = df.columns.str.strip()
+def get_dataset():
+    try:
+        return store.get()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found in uploads folder")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error loading data: {str(e)}")
 
-        # Converts mixed types (e.g., float/int)
-        df = df.convert_dtypes()  
 
-        # Replace RAND() values with a fixed snapshot
-        for col in df.columns:
-            if df[col].dtype == 'float64':  # Check numeric columns
-                df[col] = df[col].astype(float)  # Force evaluation
+def load_data():
+    return get_dataset().df
 
-        return df
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error loading data: {str(e)}")
+# Response cache =========================================
+# ========================================================
+# Successful GET responses are cached per dataset version (see app/cache.py)
+# A repeated request (e.g. /data/country/DE or /data/aggregate) is answered from memory without running the route
+# The byte budget is set with the RESPONSE_CACHE_BYTES environment variable (default 64 MiB)
+# When the Excel file changes, the new version hash drops all cached responses
+# /cache/stats shows the hit / miss counters and is never cached itself
+# Every 200 response gets an ETag, a request with a matching If-None-Match header gets "304 Not Modified"
+# /v/{version}/... (e.g. /v/<X-Dataset-Version header>/data/aggregate) pins the dataset version and can be cached forever
+# Cached bodies of 1 KiB or more also keep gzip / brotli variants, sent when Accept-Encoding allows it
+response_cache = ResponseCache()
+app.add_middleware(
+    ResponseCacheMiddleware, cache=response_cache, version=lambda: store.get().version, exclude=("/cache",)
+)
 
 
 
@@ -95,17 +139,142 @@ def load_data():
     
     
 
+# Keyset pagination and column projection =========================================
+# ==================================================================================
+# /data and the filter routes accept these optional query parameters:
+#   limit  - maximum number of rows to return
+#   cursor - row id of the last row of the previous page, only rows after it are returned
+#   fields - comma separated list of columns to return (e.g. fields=processName,country,CAS)
+# The row id is the position of the row in the dataset, the rows of every route are in row id order
+# so the next page starts right after the cursor (no offset to skip, the same cost for every page)
+# The row id of the last returned row is sent as the X-Next-Cursor header (and as next_cursor in the /data body)
+# when there are more rows, the header is missing on the last page
+# Only the rows of the page and the requested columns are serialized
+# Without these parameters all rows and all columns are returned, the same as before
+# With stream=true the rows are encoded and sent in chunks (see app/streaming.py) instead of as one JSON document
+# The JSON of every row is encoded once per dataset version, a response only joins the bytes of its rows
+# The rows are sent as MessagePack or CBOR instead of JSON if the Accept header asks for
+# application/msgpack or application/cbor (when the msgpack / cbor2 package is installed), JSON is the default
+MAX_PAGE_SIZE = 10000
+
+
+class RowPage:
+    def __init__(
+        self,
+        response: Response,
+        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of rows"),
+        cursor: Optional[int] = Query(None, ge=0, description="Row id of the last row of the previous page"),
+        fields: Optional[str] = Query(None, description="Comma separated list of columns to return"),
+        stream: bool = Query(False, description="Send the rows in chunks as they are encoded"),
+        accept: Optional[str] = Header(None, description="application/json, application/msgpack or application/cbor"),
+        dataset: Dataset = Depends(get_dataset),
+    ):
+        self.response = response
+        self.dataset = dataset
+        self.encoding = negotiate(accept)
+        self.stream = stream
+        self.limit = limit
+        self.cursor = cursor
+        self.next_cursor = None
+        self.fields = None
+        if fields is not None:
+            self.fields = [field.strip() for field in fields.split(",") if field.strip()]
+            if not self.fields:
+                raise HTTPException(status_code=400, detail="fields must name at least one column")
+            unknown = [field for field in self.fields if field not in dataset.df.columns]
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+
+    @property
+    def is_paged(self):
+        return self.limit is not None or self.cursor is not None
+
+    # Keep the positions (sorted row ids) of the requested page and remember where the next page starts
+    def select(self, positions):
+        start = 0 if self.cursor is None else int(np.searchsorted(positions, self.cursor, side="right"))
+        stop = len(positions) if self.limit is None else min(len(positions), start + self.limit)
+        if stop < len(positions):
+            self.next_cursor = int(positions[stop - 1])
+            self.response.headers["X-Next-Cursor"] = str(self.next_cursor)
+        return positions[start:stop]
+
+    # The row ids of the requested page of the given rows (all rows if positions is None)
+    def rows(self, dataset: Dataset, positions=None):
+        if positions is None:
+            positions = np.arange(len(dataset.df))
+        return self.select(positions)
+
+    # The requested columns of the given rows as array chunks in the negotiated encoding
+    # Rows with all columns are joined from the pre-serialized rows of the dataset (see RowBytes in app/encoding.py)
+    # Projected rows are taken from the dataset and encoded chunk by chunk, no DataFrame of all rows is built
+    def record_chunks(self, positions):
+        row_bytes = self.dataset.row_bytes(self.encoding) if self.fields is None else None
+        if row_bytes is not None:
+            return row_bytes.iter_array(positions)
+        return iter_records(self.dataset, positions, self.fields, self.encoding)
+
+    # The given rows as an array, streamed with stream=true
+    def records(self, positions, headers=None):
+        return self.encoded_response(self.record_chunks(positions), headers)
+
+    # document with the given rows as the value of records_key, streamed with stream=true
+    def document(self, document, records_key, positions):
+        return self.encoded_response(iter_document(document, records_key, self.record_chunks(positions), self.encoding))
+
+    # The body is already encoded, so it is sent as it is instead of going through jsonable_encoder again
+    # A returned Response does not get the headers set on self.response, so they are copied
+    def encoded_response(self, chunks, headers=None):
+        headers = dict(headers or {})
+        if self.next_cursor is not None:
+            headers["X-Next-Cursor"] = str(self.next_cursor)
+        media_type = self.encoding.media_type
+        if self.stream:
+            return StreamingResponse(chunks, media_type=media_type, headers=headers)
+        return Response(b"".join(chunks), media_type=media_type, headers=headers)
+
+
 # Reusable function to filter data by country code
-def filter_by_country(df, country_code: str):
-    if "ISOTwoLetterCountryCode" not in df.columns:
+# The rows are found in the country index of the dataset (built once per version), no column scan
+# Returns the row ids of all matching rows, the routes take the requested page of them with page.rows()
+def filter_by_country(dataset: Dataset, country_code: str):
+    if dataset.country_index is None:
         raise HTTPException(status_code=500, detail="Missing 'CountryCode' column in dataset")
-    return df[df["ISOTwoLetterCountryCode"].astype(str).str.upper() == country_code.upper()]
-
-# Reusable function to handle empty data
-def handle_empty_data(df):
-    if df.empty:
+    return dataset.country_rows(country_code)
+
+# Reusable function to filter data by process name (case-insensitive)
+# The rows are found in the process name index of the dataset, the row ids of all matching rows are returned
+def filter_by_process(dataset: Dataset, process_name: str):
+    if dataset.process_index is None:
+        raise HTTPException(status_code=500, detail="Missing 'processName' column in dataset")
+    return dataset.process_rows(process_name)
+
+# Reusable function to get the GWP aggregates of one country
+# The aggregates of all countries are computed once per dataset version (Dataset.country_gwp)
+def country_gwp_aggregate(dataset: Dataset, country_code: str):
+    if dataset.country_index is None:
+        raise HTTPException(status_code=500, detail="Missing 'CountryCode' column in dataset")
+    if dataset.country_gwp is None:
+        raise HTTPException(status_code=500, detail="Missing GWP columns in dataset")
+    aggregate = dataset.country_gwp.get(normalize_key(country_code))
+    if aggregate is None:
         raise HTTPException(status_code=404, detail="No matching data found")
-    return df
+    return aggregate
+
+# Reusable function to list the countries that best match a (misspelled) country name
+def country_suggestions(dataset: Dataset, query: str, limit: int = 5):
+    if dataset.country_matcher is None:
+        raise HTTPException(status_code=500, detail="Missing 'country' column in dataset")
+    return [
+        {"country": name, "ISOTwoLetterCountryCode": code, "score": round(score, 3)}
+        for score, name, code in dataset.country_matcher.match(query, limit=limit)
+    ]
+
+# Reusable function to handle empty data (a DataFrame or row ids)
+# Called with all matching rows before paging, so a page after the last row is an empty list and not a 404
+def handle_empty_data(rows):
+    if len(rows) == 0:
+        raise HTTPException(status_code=404, detail="No matching data found")
+    return rows
 
 
 
@@ -138,17 +307,18 @@ def test(number: int = 0):
 # The data is converted to a dictionary and returned as a JSON response
 # Headers are extracted from the DataFrame columns
 
+# limit, cursor and fields select a page of rows and columns (see RowPage), next_cursor is added when paging
 @app.get("/data")
-def get_all_data(df: pd.DataFrame = Depends(load_data)):
+def get_all_data(dataset: Dataset = Depends(get_dataset), page: RowPage = Depends()):
     try:
-        data_row = df.to_dict(orient="records")  # Convert dataframe to dictionary
-        data_col = df.columns.tolist()
-        
-        # Debugging: Print first 2 rows in terminal
-        # print("Sample Data:", data_row[:2])
-
-        response = {"headers": data_col, "data": data_row}
-        return response
+        positions = page.rows(dataset)
+        data_col = page.fields or dataset.df.columns.tolist()
+
+        # The rows are added in the negotiated encoding (or streamed in chunks) by page.document()
+        response = {"headers": data_col, "data": None}
+        if page.is_paged:
+            response["next_cursor"] = page.next_cursor
+        return page.document(response, "data", positions)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
@@ -161,11 +331,10 @@ def get_all_data(df: pd.DataFrame = Depends(load_data)):
 # Modify url path as needed (e.g., /data/country/US) to filter data by country code
 
 @app.get("/data/country/{country_code}")
-def get_data_by_country(country_code: str, df: pd.DataFrame = Depends(load_data)):
+def get_data_by_country(country_code: str, dataset: Dataset = Depends(get_dataset), page: RowPage = Depends()):
     try:
-        filtered_df = filter_by_country(df, country_code)
-        handle_empty_data(filtered_df)
-        return filtered_df.to_dict(orient="records")
+        positions = handle_empty_data(filter_by_country(dataset, country_code))
+        return page.records(page.rows(dataset, positions))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
@@ -181,15 +350,14 @@ def get_data_by_country(country_code: str, df: pd.DataFrame = Depends(load_data)
 # The query parameter is optional and can be used to filter data by country code.
 # Modify the URL path as needed (e.g., /data/country?country_code=US) to filter data by country code.
 @app.get("/data/country")
-def filter_data(country_code: str = Query(..., description="Filter by ISO country code"), df: pd.DataFrame = Depends(load_data)):
+def filter_data(country_code: str = Query(..., description="Filter by ISO country code"), dataset: Dataset = Depends(get_dataset), page: RowPage = Depends()):
     """
     Fetch data based on the given country_code query parameter.
     Example: /data/country?country_code=de
     """
     try:
-        df = filter_by_country(df, country_code)
-        handle_empty_data(df)
-        return df.to_dict(orient="records")
+        positions = handle_empty_data(filter_by_country(dataset, country_code))
+        return page.records(page.rows(dataset, positions))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
     
@@ -201,18 +369,57 @@ def filter_data(country_code: str = Query(..., description="Filter by ISO countr
 # The query parameter is defined as a function argument with a default value of None.
 # The Query function is used to define the query parameter and provide additional metadata.
 # The query parameter is optional and can be used to search data by country name or ISO code.
+# ISO code and country name are looked up in the indexes of the dataset
+# If neither matches, the fuzzy match of the country name is used if it is clear (e.g. "Netherland" or "Deutschland"),
+# the resolved country is sent in the X-Resolved-Country-Code and X-Resolved-Country headers (URL-encoded name)
+# If the match is not clear an HTTP 404 error is raised with the best suggestions of /data/search/countries
+# Set fuzzy=false to only accept exact matches
 @app.get("/data/search")
-def search_data(query: str, df: pd.DataFrame = Depends(load_data)):
+def search_data(query: str, fuzzy: bool = True, dataset: Dataset = Depends(get_dataset), page: RowPage = Depends()):
     try:
-        iso_match = df[df["ISOTwoLetterCountryCode"].astype(str).str.upper() == query.upper()]
-        country_match = df[df["country"].astype(str).str.lower() == query.lower()]
+        iso_match = filter_by_country(dataset, query)
+        if dataset.country_name_index is None:
+            raise HTTPException(status_code=500, detail="Missing 'country' column in dataset")
+        country_match = dataset.country_name_rows(query)
 
         # check input query against country name and ISO code
-        if not iso_match.empty:
-            return iso_match.to_dict(orient="records")
-        elif not country_match.empty:
-            return country_match.to_dict(orient="records")
+        # The match is chosen on all matching rows, the page is taken from the chosen rows only
+        if len(iso_match):
+            return page.records(page.rows(dataset, iso_match))
+        elif len(country_match):
+            return page.records(page.rows(dataset, country_match))
+        elif fuzzy:
+            resolved = dataset.country_matcher.resolve(query)
+            if resolved is not None:
+                _, name, country_code = resolved
+                headers = {"X-Resolved-Country-Code": country_code, "X-Resolved-Country": quote(name)}
+                return page.records(page.rows(dataset, filter_by_country(dataset, country_code)), headers)
+            raise HTTPException(
+                status_code=404,
+                detail={"message": "No matching data found", "suggestions": country_suggestions(dataset, query)},
+            )
         raise HTTPException(status_code=404, detail="No matching data found")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+
+
+# Suggest country names =========================================
+# ===============================================================
+# Returns the countries that best match the query, ranked by similarity (1.0 = exact match)
+# Useful to show "Did you mean ...?" suggestions, e.g. /data/search/countries?query=Germny
+@app.get("/data/search/countries")
+def suggest_countries(
+    query: str = Query(..., min_length=1, description="Country name, alias or misspelling"),
+    limit: int = Query(5, ge=1, le=50, description="Maximum number of suggestions"),
+    dataset: Dataset = Depends(get_dataset),
+):
+    try:
+        return country_suggestions(dataset, query, limit)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
     
@@ -223,15 +430,15 @@ def search_data(query: str, df: pd.DataFrame = Depends(load_data)):
 # The route parameter {process_name} is used to filter data by process name
 # Modify the URL path as needed (e.g., /data/process/ProcessName) to filter data by process name
 # The process name is case-insensitive and will match any case
+# The filter_by_process() function looks the name up in the process name index
 # Filter data by process name and return as JSON response
 # The handle_empty_data() function is used to check if the data is empty
 # An HTTP 404 error is raised if no matching data is found
 @app.get("/data/process/{process_name}")
-def get_data_by_process(process_name: str, df: pd.DataFrame = Depends(load_data)):
+def get_data_by_process(process_name: str, dataset: Dataset = Depends(get_dataset), page: RowPage = Depends()):
     try:
-        filtered_df = df[df["processName"].astype(str).str.lower() == process_name.lower()]
-        handle_empty_data(filtered_df)
-        return filtered_df.to_dict(orient="records")
+        positions = handle_empty_data(filter_by_process(dataset, process_name))
+        return page.records(page.rows(dataset, positions))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
     
@@ -239,6 +446,198 @@ def get_data_by_process(process_name: str, df: pd.DataFrame = Depends(load_data)
 
 
 
+# Get a single process by internalUUID =========================================
+# ==============================================================================
+# The route parameter {uuid} is the internalUUID of the row (e.g. /data/uuid/3978562e-a1e7-4ace-a199-031576d88e14)
+# The row is looked up in the UUID index of the dataset and returned as a single JSON object
+# An HTTP 404 error is raised if the UUID is unknown
+# An HTTP 409 error is raised if the UUID is not unique in the dataset
+@app.get("/data/uuid/{uuid}")
+def get_data_by_uuid(uuid: str, dataset: Dataset = Depends(get_dataset)):
+    try:
+        if dataset.uuid_index is None:
+            raise HTTPException(status_code=500, detail="Missing 'internalUUID' column in dataset")
+
+        rows = dataset.uuid_rows(uuid)
+        if len(rows) == 0:
+            raise HTTPException(status_code=404, detail="No matching data found")
+        if len(rows) > 1:
+            raise HTTPException(status_code=409, detail=f"internalUUID '{uuid}' is not unique in the dataset")
+        return dataset.rows(rows).to_dict(orient="records")[0]
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+
+
+# Get data by CAS registry number =========================================
+# ========================================================================
+# The route parameter {cas} is the CAS number of the product (e.g. /data/cas/101-81-5)
+# Dashes and leading zeros are ignored, so /data/cas/101815 and /data/cas/000101-81-5 return the same rows
+# All rows with this CAS number are returned (usually one per country)
+@app.get("/data/cas/{cas}")
+def get_data_by_cas(cas: str, dataset: Dataset = Depends(get_dataset), page: RowPage = Depends()):
+    try:
+        if dataset.cas_index is None:
+            raise HTTPException(status_code=500, detail="Missing 'CAS' column in dataset")
+
+        positions = handle_empty_data(dataset.cas_rows(cas))
+        return page.records(page.rows(dataset, positions))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+
+
+# Full-text search =========================================
+# ==========================================================
+# Search processes by words in processName, flowName and processDescription (e.g. /data/fulltext?q=steam cracking)
+# The words are looked up in an inverted index that is built once per dataset version
+# Results are ranked with BM25, the best matching rows come first
+# limit and offset are used for pagination, total is the number of all matching rows
+@app.get("/data/fulltext")
+def fulltext_search(
+    q: str = Query(..., min_length=1, description="Words to search for"),
+    limit: int = Query(10, ge=1, le=100, description="Number of results per page"),
+    offset: int = Query(0, ge=0, description="Number of results to skip"),
+    dataset: Dataset = Depends(get_dataset),
+):
+    try:
+        if dataset.fulltext_index is None:
+            raise HTTPException(status_code=500, detail="Missing text columns in dataset")
+
+        total, hits = dataset.fulltext_index.search(q, limit=limit, offset=offset)
+        records = dataset.rows([row for _, row in hits]).to_dict(orient="records")
+
+        return {
+            "query": q,
+            "total": total,
+            "offset": offset,
+            "limit": limit,
+            "results": [{"score": round(score, 4), "data": record} for (score, _), record in zip(hits, records)],
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+
+
+
+# Filter with a query expression =========================================
+# =========================================================================
+# Several filters can be combined in one expression (see app/query.py for the syntax), e.g.
+#   /data/query?q=ISOTwoLetterCountryCode in ('DE', 'FR') and GWP100 < 2.5
+# Fields are column names, impact ids from /schema/impacts or indicator codes like GWP100
+# The expression is compiled once per dataset version into numpy mask operations and then reused
+# Equality filters on indexed columns (country code, country, processName, internalUUID, CAS) use the indexes
+# An invalid expression or an unknown field returns HTTP 400 with the reason
+@app.get("/data/query")
+def query_data(
+    q: str = Query(..., min_length=1, description="Filter expression"),
+    dataset: Dataset = Depends(get_dataset),
+    page: RowPage = Depends(),
+):
+    try:
+        try:
+            plan = compile_query(dataset, q)
+        except QueryError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid query: {str(e)}")
+
+        positions = handle_empty_data(plan.rows())
+        return page.records(page.rows(dataset, positions))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+
+
+
+# Arrow / Parquet export =========================================
+# ================================================================
+# /export/arrow returns the rows as an Arrow IPC stream, /export/parquet as a Parquet file (see app/export.py)
+# Filters (all optional, combined with AND):
+#   country_code - ISO country code, e.g. DE
+#   process_name - process name (case-insensitive)
+#   cas          - CAS number
+#   q            - query expression, the same as /data/query
+# limit, cursor and fields work the same as on /data (see RowPage), the next cursor is sent as X-Next-Cursor
+# The record batches are converted from the in-memory columns and streamed one by one
+# Without pyarrow an HTTP 501 error is returned
+
+# Reusable function to find the row ids (sorted) that match the export filters, all rows without filters
+def export_rows(
+    country_code: Optional[str] = Query(None, description="Filter by ISO country code"),
+    process_name: Optional[str] = Query(None, description="Filter by process name"),
+    cas: Optional[str] = Query(None, description="Filter by CAS number"),
+    q: Optional[str] = Query(None, min_length=1, description="Filter expression, see /data/query"),
+    dataset: Dataset = Depends(get_dataset),
+):
+    positions = np.arange(len(dataset.df))
+    lookups = [
+        (country_code, dataset.country_index, dataset.country_rows, "CountryCode"),
+        (process_name, dataset.process_index, dataset.process_rows, "processName"),
+        (cas, dataset.cas_index, dataset.cas_rows, "CAS"),
+    ]
+    for value, index, rows, column in lookups:
+        if value is None:
+            continue
+        if index is None:
+            raise HTTPException(status_code=500, detail=f"Missing '{column}' column in dataset")
+        positions = np.intersect1d(positions, rows(value), assume_unique=True)
+    if q is not None:
+        try:
+            mask = compile_query(dataset, q).mask()
+        except QueryError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid query: {str(e)}")
+        positions = positions[mask[positions]]
+    return positions
+
+
+# Reusable function to stream the page of the given rows in an export format
+def export_response(dataset: Dataset, page: RowPage, positions, iter_export, media_type: str, filename: str):
+    if not EXPORT_AVAILABLE:
+        raise HTTPException(status_code=501, detail="pyarrow is required to export data")
+    positions = page.select(positions)
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if page.next_cursor is not None:
+        headers["X-Next-Cursor"] = str(page.next_cursor)
+    return StreamingResponse(iter_export(dataset, positions, page.fields), media_type=media_type, headers=headers)
+
+
+@app.get("/export/arrow")
+def export_arrow(
+    positions=Depends(export_rows),
+    dataset: Dataset = Depends(get_dataset),
+    page: RowPage = Depends(),
+):
+    try:
+        return export_response(dataset, page, positions, iter_arrow_stream, ARROW_MEDIA_TYPE, "data.arrows")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+
+@app.get("/export/parquet")
+def export_parquet(
+    positions=Depends(export_rows),
+    dataset: Dataset = Depends(get_dataset),
+    page: RowPage = Depends(),
+):
+    try:
+        return export_response(dataset, page, positions, iter_parquet, PARQUET_MEDIA_TYPE, "data.parquet")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+
+
+
 # Aggregating GWP data by country =========================================
 # =========================================================================
 # Agrregating data by country code
@@ -247,29 +646,15 @@ def get_data_by_process(process_name: str, df: pd.DataFrame = Depends(load_data)
 # Total GWP100 is calculated as the sum of all GWP columns
 # The result is returned as a JSON response with the total GWP100 value
 # Modify the URL path as needed (e.g., /data/gwp/aggregate/US) to aggregate GWP data by country code
+# The sums are read from the aggregate table of the dataset, nothing is computed per request
 @app.get("/data/gwp/aggregate/{country_code}")
-def get_gwp_aggregate_by_country(country_code: str, df: pd.DataFrame = Depends(load_data)):
+def get_gwp_aggregate_by_country(country_code: str, dataset: Dataset = Depends(get_dataset)):
     try:
-        country_data = filter_by_country(df, country_code)
-        handle_empty_data(country_data)
-        
-        gwp_columns = [
-            "Carbon Minds ISO 14067 (based on IPCC 2021) - climate change - global warming potential (GWP100) [kg CO2-Eq]",
-            "Carbon Minds ISO 14067 (based on IPCC 2021) - climate change: biogenic emissions - global warming potential (GWP100) [kg CO2-Eq]",
-            "Carbon Minds ISO 14067 (based on IPCC 2021) - climate change: biogenic removal - global warming potential (GWP100) [kg CO2-Eq]",
-            "Carbon Minds ISO 14067 (based on IPCC 2021) - climate change: fossil - global warming potential (GWP100) [kg CO2-Eq]",
-            "Carbon Minds ISO 14067 (based on IPCC 2021) - climate change: land use - global warming potential (GWP100) [kg CO2-Eq]"
-        ]
-
-        country_data[gwp_columns] = country_data[gwp_columns].apply(pd.to_numeric, errors="coerce").fillna(0)
-        country_data[gwp_columns] = country_data[gwp_columns].astype(float)
-
-        gwp_sums = country_data[gwp_columns].sum().to_dict()
-        total_gwp = sum(gwp_sums.values())
+        aggregate = country_gwp_aggregate(dataset, country_code)
 
         return {
-            "country": country_data["country"].iloc[0],
-            "total_GWP100": round(total_gwp, 2),
+            "country": aggregate["name"],
+            "total_GWP100": round(aggregate["total"], 2),
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
@@ -277,6 +662,49 @@ def get_gwp_aggregate_by_country(country_code: str, df: pd.DataFrame = Depends(l
 
     
 
+# GWP leaderboard of all countries =========================================
+# =========================================================================
+# Returns the GWP100 totals of every country in one response (e.g. /data/aggregate?sort=total&order=desc&limit=10)
+# The totals come from the aggregate table of the dataset (one group-by for all countries)
+# sort: total, min, max, name or code; order: asc or desc
+# limit and offset are used for pagination
+@app.get("/data/aggregate")
+def get_aggregate_leaderboard(
+    sort: Literal["total", "min", "max", "name", "code"] = Query("total", description="Field to sort by"),
+    order: Literal["asc", "desc"] = Query("desc", description="Sort order"),
+    limit: int = Query(None, ge=1, description="Maximum number of countries to return"),
+    offset: int = Query(0, ge=0, description="Number of countries to skip"),
+    dataset: Dataset = Depends(get_dataset),
+):
+    try:
+        if dataset.country_leaderboard is None:
+            raise HTTPException(status_code=500, detail="Missing GWP columns in dataset")
+
+        entries = dataset.country_leaderboard.ranked(sort, descending=order == "desc", limit=limit, offset=offset)
+
+        return {
+            "total_countries": len(dataset.country_leaderboard.entries),
+            "offset": offset,
+            "limit": limit,
+            "countries": [
+                {
+                    "rank": offset + i + 1,
+                    "country": entry["name"],
+                    "ISOTwoLetterCountryCode": entry["code"],
+                    "total_GWP100": round(entry["total"], 2),
+                    "min_GWP100": round(entry["min"], 2),
+                    "max_GWP100": round(entry["max"], 2),
+                }
+                for i, entry in enumerate(entries)
+            ],
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+
+
 # Aggregating data by country and returning additional statistics =========================================
 # ========================================================================================================
 # The route parameter {country_code} is used to filter data by country code (e.g., "US". "DE", "GB")
@@ -286,41 +714,134 @@ def get_gwp_aggregate_by_country(country_code: str, df: pd.DataFrame = Depends(l
 # Modify the URL path as needed (e.g., /data/gwp/aggregate/US) to aggregate GWP data by country code
 # Additional statistics such as min and max GWP100 values are calculated
 # The result also includes the column-wise total GWP100 values
+# The sums are read from the same aggregate table as /data/gwp/aggregate/{country_code}
 @app.get("/data/aggregate/{country_code}")
-def get_aggregate_by_country(country_code: str, df: pd.DataFrame = Depends(load_data)):
+def get_aggregate_by_country(country_code: str, dataset: Dataset = Depends(get_dataset)):
     try:
-        country_data = filter_by_country(df, country_code)
-        handle_empty_data(country_data)
+        aggregate = country_gwp_aggregate(dataset, country_code)
 
-        country_name = country_data["country"].values[0]
+        gwp_sums = {key: round(value, 2) for key, value in aggregate["by_column"].items()}
 
-        # select columns for aggregation
-        gwp_columns = [
-            "Carbon Minds ISO 14067 (based on IPCC 2021) - climate change - global warming potential (GWP100) [kg CO2-Eq]",
-            "Carbon Minds ISO 14067 (based on IPCC 2021) - climate change: biogenic emissions - global warming potential (GWP100) [kg CO2-Eq]",
-            "Carbon Minds ISO 14067 (based on IPCC 2021) - climate change: biogenic removal - global warming potential (GWP100) [kg CO2-Eq]",
-            "Carbon Minds ISO 14067 (based on IPCC 2021) - climate change: fossil - global warming potential (GWP100) [kg CO2-Eq]",
-            "Carbon Minds ISO 14067 (based on IPCC 2021) - climate change: land use - global warming potential (GWP100) [kg CO2-Eq]"
-        ]
+        return {
+            "country": aggregate["name"],
+            "total_GWP100": round(aggregate["total"], 2),
+            "min_GWP100": round(aggregate["min"], 2),
+            "max_GWP100": round(aggregate["max"], 2),
+            "total_GWP100_by_column": gwp_sums
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+    
 
 
-        gwp_sums = country_data[gwp_columns].sum().to_dict()
-        total_gwp = sum(gwp_sums.values())
-        min_gwp = min(gwp_sums.values())
-        max_gwp = max(gwp_sums.values())
+# Statistics of numeric columns =========================================
+# =======================================================================
+# Computes any of count, sum, mean, std, min, max, null_count, median and quantiles (p0 ... p100, e.g. p90)
+# for numeric columns, optionally per group (e.g. /data/stats?stats=mean,std,p90&group_by=ISOTwoLetterCountryCode)
+# columns can be repeated (?columns=a&columns=b), by default the GWP100 columns are used
+# impacts is a comma-separated list of impact ids from /schema/impacts and can be used instead of the long column names
+# country_code limits the rows to one country (looked up in the country index), an unknown code returns HTTP 404
+# All statistics are computed together by the aggregation engine (see app/aggregates.py)
+# sum, count, null_count and mean of impact columns for one country are read from the prefix sums of the impact matrix
+@app.get("/data/stats")
+def get_statistics(
+    stats: str = Query("count,sum,mean,min,max", description="Comma-separated list of statistics"),
+    columns: List[str] = Query(None, description="Numeric columns to aggregate"),
+    impacts: str = Query(None, description="Comma-separated impact ids (see /schema/impacts)"),
+    group_by: str = Query(None, description="Column to group by"),
+    country_code: str = Query(None, description="Only use rows of this ISO country code"),
+    dataset: Dataset = Depends(get_dataset),
+):
+    try:
+        df = dataset.df
+        stat_names = [name.strip() for name in stats.split(",") if name.strip()]
+        unknown = [name for name in stat_names if not is_statistic(name)]
+        if not stat_names or unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown statistics: {', '.join(unknown) or stats}")
+
+        if impacts:
+            try:
+                impact_ids = [impact_id.strip() for impact_id in impacts.split(",") if impact_id.strip()]
+                columns = (columns or []) + [impact.column for impact in dataset.impacts.resolve(impact_ids)]
+            except KeyError as e:
+                raise HTTPException(status_code=400, detail=f"Unknown impact id {e}")
+        columns = columns or dataset.gwp_columns
+        for col in columns:
+            if col not in df.columns:
+                raise HTTPException(status_code=400, detail=f"Unknown column '{col}'")
+            if not pd.api.types.is_numeric_dtype(df[col].dtype):
+                raise HTTPException(status_code=400, detail=f"Column '{col}' is not numeric")
+        if group_by is not None and group_by not in df.columns:
+            raise HTTPException(status_code=400, detail=f"Unknown column '{group_by}'")
+        # An unknown country code is a 404, the same as on the other country routes
+        if country_code is not None:
+            country_rows = handle_empty_data(filter_by_country(dataset, country_code))
+
+        matrix = dataset.impact_matrix
+        if (
+            country_code is not None
+            and group_by is None
+            and matrix is not None
+            and set(stat_names) <= PREFIX_STATISTICS
+            and matrix.has_columns(columns)
+        ):
+            # Fast path: sums and counts of one country are read from the prefix sums of the impact matrix
+            results = matrix.group_statistics(normalize_key(country_code), columns, stat_names)
+            groups = [None]
+            results = {name: np.atleast_2d(values) for name, values in results.items()}
+        else:
+            if country_code is not None:
+                df = dataset.rows(country_rows)
+            groups, results = aggregate(df, columns, stat_names, group_column=group_by)
 
-        gwp_sums = {key: round(value, 2) for key, value in gwp_sums.items()}
+        # NaN (e.g. std of a single value) is returned as null
+        def value(name, x):
+            if np.isnan(x):
+                return None
+            return int(x) if name in COUNT_STATISTICS else float(x)
 
         return {
-            "country": country_name,
-            "total_GWP100": round(total_gwp, 2),
-            "min_GWP100": round(min_gwp, 2),
-            "max_GWP100": round(max_gwp, 2),
-            "total_GWP100_by_column": gwp_sums
+            "group_by": group_by,
+            "stats": stat_names,
+            "groups": [
+                {
+                    "group": group,
+                    "columns": {
+                        col: {name: value(name, results[name][i, j]) for name in stat_names}
+                        for j, col in enumerate(columns)
+                    },
+                }
+                for i, group in enumerate(groups)
+            ],
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
-    
+
+
+
+# Response cache statistics =========================================
+# ===================================================================
+# Number of cached responses, their size and the hit / miss / eviction counters
+@app.get("/cache/stats")
+def get_cache_stats():
+    return response_cache.stats()
+
+
+
+
+# Impact categories =========================================
+# ===========================================================
+# Lists the impact columns found in the dataset with their parsed header
+# (method, category, sub-category, indicator, unit) and the short id used by /data/stats?impacts=...
+@app.get("/schema/impacts")
+def get_impact_schema(dataset: Dataset = Depends(get_dataset)):
+    try:
+        return {"impacts": [impact._asdict() for impact in dataset.impacts.impacts]}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
 
 
 # Search for process names =========================================
@@ -328,35 +849,40 @@ def get_aggregate_by_country(country_code: str, df: pd.DataFrame = Depends(load_
 #  Users can search for process names using the /data/process_names/search endpoint
 # The search query looks for process names that start with the specified query string
 # The process names are returned as a list of strings
+# The names are looked up in a sorted prefix index (built once per dataset version), matches are sorted by name
+# The limit query parameter returns only the first matches, e.g. for autocomplete
+# With mode=contains the process name can contain the query string anywhere in the name (e.g. ?query=chlor&mode=contains)
+# Contains search uses a trigram index of the process names, so it does not scan all names either
 @app.get("/data/process_names/search")
 def get_process_names(
     query: str = Query(None, description="Search for process names"),
-    df: pd.DataFrame = Depends(load_data),
+    limit: int = Query(None, ge=1, description="Maximum number of process names to return"),
+    mode: Literal["prefix", "contains"] = Query("prefix", description="Match the start of the name or any part of it"),
+    dataset: Dataset = Depends(get_dataset),
 ):
     try:
-        if "processName" not in df.columns:
+        process_names = dataset.process_names
+        if process_names is None:
             raise HTTPException(status_code=500, detail="Missing 'processName' column in dataset")
 
-        process_names = df["processName"].dropna().unique().tolist()
-
         if query:
 
-            # The following code can be used to filter process names containing the query string
-            # The process name can contain the query string anywhere in the name
-            # =====================================================
-            # filtered_names = [name for name in process_names if query.lower() in name.lower()]
-
-            # The following code filters process names starting with the query string
-            # The process look letter from the start of the process name
-            # =====================================================
-            filtered_names = [name for name in process_names if name.lower().startswith(query.lower())]
+            if mode == "contains":
+                # Filter process names containing the query string anywhere in the name
+                # =====================================================
+                filtered_names = dataset.process_name_grams.search(query, limit=limit)
+            else:
+                # The following code filters process names starting with the query string
+                # The process look letter from the start of the process name
+                # =====================================================
+                filtered_names = process_names.search(query, limit=limit)
 
             if not filtered_names:
                 return {"message": "No Process Name found"}  # Return message when no match is found
             
         else:
-            filtered_names = process_names  
+            filtered_names = process_names.values[:limit]
 
         return {"process_names": filtered_names}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
@@ -0,0 +1,343 @@
+import re
+import threading
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from .indexes import normalize_cas, normalize_key
+
+
+# Filter query language =========================================
+# ===============================================================
+# A small expression language to combine filters in one request, e.g.
+#   ISOTwoLetterCountryCode in ('DE', 'FR') and type = 'technology-specific (simplified extension layer)' and GWP100 < 2.5
+# Supported:
+#   field = value, !=, <, <=, >, >=       (text is compared case-insensitive)
+#   field in (v1, v2, ...), field not in (...)
+#   field contains 'text'                  (case-insensitive substring)
+#   field is null, field is not null
+#   and, or, not, parentheses
+# A field is a column name (use `backticks` or "double quotes" for names with spaces), an impact id from
+# /schema/impacts, or an indicator code like GWP100 (the impact of that indicator without sub-category
+# of the default impact method, see app/impacts.py)
+# Text values are 'single quoted' ('' for a quote inside), single words can be written without quotes
+#
+# The text is parsed into a syntax tree (cached by text), then checked against the columns of the dataset
+# and compiled into numpy boolean mask operations (cached per dataset version by text)
+# Equality and "in" on indexed columns (country code, country, processName, internalUUID, CAS) use the indexes
+
+
+class QueryError(ValueError):
+    pass
+
+
+_TOKEN = re.compile(
+    r"""\s*(?:
+        (?P<number>-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+      | (?P<string>'(?:[^']|'')*')
+      | (?P<quoted>`[^`]+`|"[^"]+")
+      | (?P<op><=|>=|!=|<>|==|=|<|>)
+      | (?P<punct>[(),])
+      | (?P<word>[A-Za-z_][A-Za-z0-9_.]*)
+    )""",
+    re.VERBOSE,
+)
+
+KEYWORDS = {"and", "or", "not", "in", "is", "null", "contains"}
+# Maximum nesting of parentheses and "not", deeper queries are rejected before the parser runs out of stack
+MAX_DEPTH = 50
+COMPARISONS = {"=": "=", "==": "=", "!=": "!=", "<>": "!=", "<": "<", "<=": "<=", ">": ">", ">=": ">="}
+
+
+def tokenize(text):
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None or match.end() == position:
+            raise QueryError(f"Unexpected character at position {position}: {text[position:position + 10]!r}")
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "word" and value.casefold() in KEYWORDS:
+            tokens.append(("keyword", value.casefold()))
+        elif kind == "string":
+            tokens.append(("string", value[1:-1].replace("''", "'")))
+        elif kind == "quoted":
+            tokens.append(("field", value[1:-1]))
+        elif kind == "op":
+            tokens.append(("op", COMPARISONS[value]))
+        else:
+            tokens.append((kind, value))
+    return tokens
+
+
+# Recursive descent parser ==================================
+# Syntax tree nodes are tuples:
+#   ("and", [nodes]), ("or", [nodes]), ("not", node)
+#   ("cmp", field, op, value), ("in", field, [values], negated), ("null", field, negated), ("contains", field, text)
+# A value is ("number", float, text) or ("string", text)
+class _Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+        self.depth = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def accept(self, kind, value=None):
+        token = self.peek()
+        if token[0] == kind and (value is None or token[1] == value):
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, kind, value=None):
+        if not self.accept(kind, value):
+            found = self.peek()[1]
+            raise QueryError(f"Expected {value or kind} but found {found!r}" if found else f"Expected {value or kind}")
+
+    def parse(self):
+        node = self.parse_or()
+        if self.position != len(self.tokens):
+            raise QueryError(f"Unexpected {self.peek()[1]!r}")
+        return node
+
+    def parse_or(self):
+        nodes = [self.parse_and()]
+        while self.accept("keyword", "or"):
+            nodes.append(self.parse_and())
+        return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def parse_and(self):
+        nodes = [self.parse_not()]
+        while self.accept("keyword", "and"):
+            nodes.append(self.parse_not())
+        return nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+    def parse_not(self):
+        if self.accept("keyword", "not"):
+            return ("not", self.nested(self.parse_not))
+        if self.accept("punct", "("):
+            node = self.nested(self.parse_or)
+            self.expect("punct", ")")
+            return node
+        return self.parse_predicate()
+
+    def nested(self, parse):
+        self.depth += 1
+        if self.depth > MAX_DEPTH:
+            raise QueryError(f"Query is nested too deeply (more than {MAX_DEPTH} levels)")
+        node = parse()
+        self.depth -= 1
+        return node
+
+    def parse_predicate(self):
+        kind, field = self.take()
+        if kind not in ("word", "field"):
+            raise QueryError(f"Expected a field name but found {field!r}" if field else "Expected a field name")
+
+        if self.accept("keyword", "is"):
+            negated = self.accept("keyword", "not")
+            self.expect("keyword", "null")
+            return ("null", field, negated)
+        if self.accept("keyword", "contains"):
+            value = self.parse_value()
+            return ("contains", field, value[-1])
+        negated = self.accept("keyword", "not")
+        if self.accept("keyword", "in"):
+            self.expect("punct", "(")
+            values = [self.parse_value()]
+            while self.accept("punct", ","):
+                values.append(self.parse_value())
+            self.expect("punct", ")")
+            return ("in", field, values, negated)
+        if negated:
+            raise QueryError("Expected 'in' after 'not'")
+
+        kind, op = self.take()
+        if kind != "op":
+            raise QueryError(f"Expected a comparison after {field!r}")
+        return ("cmp", field, op, self.parse_value())
+
+    def parse_value(self):
+        kind, value = self.take()
+        if kind == "number":
+            return ("number", float(value), value)
+        if kind in ("string", "word"):
+            return ("string", value)
+        raise QueryError(f"Expected a value but found {value!r}" if value else "Expected a value")
+
+
+@lru_cache(maxsize=1024)
+def parse_query(text):
+    tokens = tokenize(text)
+    if not tokens:
+        raise QueryError("Empty query")
+    return _Parser(tokens).parse()
+
+
+# Compiling =========================================
+# ===================================================
+# Columns with an index: column -> (Dataset index attribute, key normalize function)
+INDEXED_COLUMNS = {
+    "ISOTwoLetterCountryCode": ("country_index", normalize_key),
+    "country": ("country_name_index", normalize_key),
+    "processName": ("process_index", normalize_key),
+    "internalUUID": ("uuid_index", normalize_key),
+    "CAS": ("cas_index", normalize_cas),
+}
+
+MAX_CACHED_PLANS = 256
+_plans_lock = threading.Lock()
+
+
+def resolve_field(dataset, field):
+    columns = dataset.df.columns
+    if field in columns:
+        return field
+    impact = dataset.impacts.get(field)
+    if impact is not None:
+        return impact.column
+    headline = [impact for impact in dataset.impacts.with_indicator(field) if impact.sub_category is None]
+    if len(headline) == 1:
+        return headline[0].column
+    matches = [col for col in columns if str(col).casefold() == field.casefold()]
+    if len(matches) == 1:
+        return matches[0]
+    raise QueryError(f"Unknown field {field!r}")
+
+
+class QueryPlan:
+    def __init__(self, dataset, tree):
+        self.dataset = dataset
+        self.n_rows = len(dataset.df)
+        self._numeric = {}
+        self.evaluate = self.compile(tree)
+
+    # Boolean mask over all rows of the dataset
+    def mask(self):
+        return self.evaluate()
+
+    def rows(self):
+        return np.flatnonzero(self.mask())
+
+    def compile(self, node):
+        kind = node[0]
+        if kind in ("and", "or"):
+            parts = [self.compile(child) for child in node[1]]
+            combine = np.logical_and if kind == "and" else np.logical_or
+            return lambda: combine.reduce([part() for part in parts])
+        if kind == "not":
+            part = self.compile(node[1])
+            return lambda: ~part()
+
+        column = resolve_field(self.dataset, node[1])
+        series = self.dataset.df[column]
+        numeric = pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype)
+
+        if kind == "null":
+            negated = node[2]
+            return lambda: series.notna().to_numpy() if negated else series.isna().to_numpy()
+
+        if kind == "contains":
+            if numeric:
+                raise QueryError(f"'contains' needs a text field, {column!r} is numeric")
+            return self.compile_contains(series, node[2])
+
+        if kind == "in":
+            values, negated = node[2], node[3]
+            part = self.compile_equals(column, series, numeric, values)
+            return (lambda: ~part()) if negated else part
+
+        op, value = node[2], node[3]
+        if op in ("=", "!="):
+            part = self.compile_equals(column, series, numeric, [value])
+            return (lambda: ~part()) if op == "!=" else part
+        if not numeric:
+            raise QueryError(f"{op!r} needs a numeric field, {column!r} is text")
+        if value[0] != "number":
+            raise QueryError(f"{op!r} needs a number, found {value[1]!r}")
+        values = self.numeric_values(column)
+        number = value[1]
+        compare = {"<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal}[op]
+        return lambda: compare(values, number)
+
+    # Missing numeric values become NaN, every comparison with NaN is False
+    def numeric_values(self, column):
+        if column not in self._numeric:
+            self._numeric[column] = self.dataset.df[column].to_numpy(dtype=np.float64, na_value=np.nan)
+        return self._numeric[column]
+
+    def compile_equals(self, column, series, numeric, values):
+        if numeric:
+            numbers = []
+            for value in values:
+                if value[0] != "number":
+                    raise QueryError(f"{column!r} is numeric, found {value[1]!r}")
+                numbers.append(value[1])
+            column_values = self.numeric_values(column)
+            return lambda: np.isin(column_values, numbers)
+
+        texts = [value[-1] for value in values]
+        index_name, normalize = INDEXED_COLUMNS.get(column, (None, None))
+        index = getattr(self.dataset, index_name) if index_name else None
+        if index is not None:
+            # Look the rows up in the index, no column scan
+            keys = [normalize(text) for text in texts]
+            n_rows = self.n_rows
+
+            def from_index():
+                mask = np.zeros(n_rows, dtype=bool)
+                for key in keys:
+                    rows = index.get(key)
+                    if rows is not None:
+                        mask[rows] = True
+                return mask
+            return from_index
+
+        keys = {normalize_key(text) for text in texts}
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # Compare the dictionary once, then match the rows on their integer codes
+            categories = series.cat.categories
+            hits = [i for i, category in enumerate(categories) if normalize_key(category) in keys]
+            codes = series.cat.codes.to_numpy()
+            return lambda: np.isin(codes, hits)
+        folded = series.astype(str).str.casefold().to_numpy()
+        return lambda: np.isin(folded, list(keys)) & series.notna().to_numpy()
+
+    def compile_contains(self, series, text):
+        needle = text.casefold()
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            categories = series.cat.categories
+            hits = [i for i, category in enumerate(categories) if needle in str(category).casefold()]
+            codes = series.cat.codes.to_numpy()
+            return lambda: np.isin(codes, hits)
+        return lambda: series.astype(str).str.casefold().str.contains(needle, regex=False).to_numpy() & series.notna().to_numpy()
+
+
+# Compiled plans are cached per dataset version by the query text (least recently used are dropped first)
+# Raises QueryError if the text is not a valid query for this dataset
+def compile_query(dataset, text):
+    text = text.strip()
+    plans = dataset.query_plans
+    with _plans_lock:
+        plan = plans.get(text)
+        if plan is not None:
+            plans.move_to_end(text)
+            return plan
+
+    plan = QueryPlan(dataset, parse_query(text))
+    with _plans_lock:
+        plans[text] = plan
+        if len(plans) > MAX_CACHED_PLANS:
+            plans.popitem(last=False)
+    return plan
@@ -0,0 +1,209 @@
+import heapq
+import math
+import re
+
+import numpy as np
+
+
+# Full-text search (BM25) =========================================
+# =================================================================
+# Every row is one document made of the text of a few columns (e.g. processName, flowName, processDescription)
+# The text is split into lower-case word tokens once, when the dataset is loaded
+# For every token the index keeps the rows that contain it and how often (term frequency)
+# A query only reads the posting lists of its own tokens, the raw text is never scanned again
+# Rows are scored with BM25 and the best offset + limit rows are picked with a heap
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.casefold())
+
+
+class FullTextIndex:
+    def __init__(self, documents, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.n_docs = len(documents)
+
+        # Many rows share the same text, tokenize each distinct text only once
+        token_cache = {}
+        postings = {}
+        lengths = np.zeros(self.n_docs, dtype=np.float64)
+        for row, text in enumerate(documents):
+            counts = token_cache.get(text)
+            if counts is None:
+                counts = {}
+                for token in tokenize(text):
+                    counts[token] = counts.get(token, 0) + 1
+                token_cache[text] = counts
+            lengths[row] = sum(counts.values())
+            for token, tf in counts.items():
+                postings.setdefault(token, ([], []))
+                postings[token][0].append(row)
+                postings[token][1].append(tf)
+
+        self.lengths = lengths
+        self.avg_length = lengths.mean() if self.n_docs else 0.0
+        self.postings = {
+            token: (np.array(rows, dtype=np.intp), np.array(tfs, dtype=np.float64))
+            for token, (rows, tfs) in postings.items()
+        }
+
+    def idf(self, token):
+        df = len(self.postings[token][0])
+        return math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+
+    # Return (number of matching rows, [(score, row), ...]) for the requested page, best score first
+    def search(self, query, limit=10, offset=0):
+        tokens = [token for token in dict.fromkeys(tokenize(query)) if token in self.postings]
+        if not tokens:
+            return 0, []
+
+        rows = []
+        scores = []
+        for token in tokens:
+            token_rows, tfs = self.postings[token]
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[token_rows] / self.avg_length)
+            rows.append(token_rows)
+            scores.append(self.idf(token) * tfs * (self.k1 + 1) / (tfs + norm))
+
+        matched, inverse = np.unique(np.concatenate(rows), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate(scores))
+
+        # Ties are broken by row position so the order is stable between requests
+        top = heapq.nlargest(offset + limit, zip(totals.tolist(), (-matched).tolist()))
+        return len(matched), [(score, -neg_row) for score, neg_row in top[offset:]]
+
+
+# Fuzzy country name matching =========================================
+# =====================================================================
+# Misspelled or alternative country names ("Germny", "United States of America") are matched by trigram similarity
+# The index only holds the distinct country names and a few common aliases, so it is tiny
+# (ISO codes are not in it, they are looked up exactly in the country code index before fuzzy matching is tried)
+# Every name is split into trigrams of " name " (padded so the first and last letters count too)
+# A query only looks at the names that share at least one trigram with it and ranks them by Dice similarity
+# A single typo already breaks up to three trigrams ("Germny" / "Germany" is only 0.67 Dice), while short names share
+# many trigrams by chance ("Peru" / "Persia", "Chile" / "China"), so to resolve a query to one country the trigram
+# candidates are ranked again by edit similarity: 1 - Damerau-Levenshtein distance / length of the longer name
+# The query is resolved if the best candidate is close (RESOLVE_SCORE, i.e. one typo in 5 to 9 letters, two from 10)
+# and clearly better than the next country (RESOLVE_MARGIN), otherwise the matches are only offered as suggestions
+RESOLVE_SCORE = 0.8
+RESOLVE_MARGIN = 0.15
+
+# Common alternative names, only the ones whose ISO code exists in the dataset are used
+COUNTRY_ALIASES = {
+    "united states of america": "US",
+    "usa": "US",
+    "america": "US",
+    "united kingdom of great britain and northern ireland": "GB",
+    "great britain": "GB",
+    "britain": "GB",
+    "england": "GB",
+    "uk": "GB",
+    "deutschland": "DE",
+    "holland": "NL",
+    "the netherlands": "NL",
+    "south korea": "KR",
+    "republic of korea": "KR",
+    "north korea": "KP",
+    "korea": "KR",
+    "russian federation": "RU",
+    "czech republic": "CZ",
+    "czechia": "CZ",
+    "turkiye": "TR",
+    "türkiye": "TR",
+    "uae": "AE",
+    "emirates": "AE",
+    "persia": "IR",
+    "iran, islamic republic of": "IR",
+    "viet nam": "VN",
+    "taiwan, province of china": "TW",
+    "ivory coast": "CI",
+    "côte d'ivoire": "CI",
+}
+
+
+# Edit distance with insertions, deletions, substitutions and transpositions of two neighbouring letters
+# (optimal string alignment), computed row by row
+def edit_distance(a, b):
+    before_previous, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before_previous[j - 2] + 1)
+        before_previous, previous = previous, current
+    return previous[-1]
+
+
+def edit_similarity(a, b):
+    longest = max(len(a), len(b))
+    return 1.0 - edit_distance(a, b) / longest if longest else 1.0
+
+
+def trigrams(text):
+    padded = f"  {text.casefold()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CountryMatcher:
+    # countries is a list of (country name, ISO code) pairs
+    def __init__(self, countries, aliases=COUNTRY_ALIASES):
+        codes = {code.casefold(): code for _, code in countries}
+        self.names = {}  # normalized name -> (display name, ISO code)
+        for name, code in countries:
+            self.names.setdefault(name.casefold(), (name, code))
+        display = {code: name for name, code in countries}
+        for alias, code in aliases.items():
+            if code.casefold() in codes:
+                code = codes[code.casefold()]
+                self.names.setdefault(alias.casefold(), (display[code], code))
+
+        self.keys = list(self.names)
+        self.grams = [trigrams(key) for key in self.keys]
+        self.postings = {}
+        for key_id, grams in enumerate(self.grams):
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(key_id)
+
+    # key id -> Dice similarity of the names that share at least one trigram with the query
+    def candidates(self, query):
+        query_grams = trigrams(query)
+        overlap = {}
+        for gram in query_grams:
+            for key_id in self.postings.get(gram, ()):
+                overlap[key_id] = overlap.get(key_id, 0) + 1
+        return {
+            key_id: 2 * shared / (len(query_grams) + len(self.grams[key_id]))
+            for key_id, shared in overlap.items()
+        }
+
+    # Best (score, country name, ISO code) per country, aliases of the same country are merged
+    def best_per_country(self, scores, min_score):
+        best = {}
+        for key_id, score in scores.items():
+            name, code = self.names[self.keys[key_id]]
+            if score >= min_score and score > best.get(code, (0,))[0]:
+                best[code] = (score, name, code)
+        return best.values()
+
+    # Return up to limit (score, country name, ISO code) tuples with score >= min_score, best first
+    # The score is the trigram similarity
+    def match(self, query, limit=5, min_score=0.3):
+        best = self.best_per_country(self.candidates(query), min_score)
+        return heapq.nlargest(limit, best, key=lambda item: (item[0], item[2]))
+
+    # The (score, country name, ISO code) the query clearly means, or None if it is not clear enough
+    # The score is the edit similarity of the best trigram candidate of every country
+    def resolve(self, query, min_score=RESOLVE_SCORE, min_margin=RESOLVE_MARGIN):
+        text = query.strip().casefold()
+        scores = {key_id: edit_similarity(text, self.keys[key_id]) for key_id in self.candidates(query)}
+        candidates = heapq.nlargest(2, self.best_per_country(scores, 0.0), key=lambda item: (item[0], item[2]))
+        if not candidates or candidates[0][0] < min_score:
+            return None
+        if len(candidates) > 1 and candidates[0][0] - candidates[1][0] < min_margin:
+            return None
+        return candidates[0]
@@ -0,0 +1,113 @@
+import logging
+import os
+import sys
+
+from .store import file_hash, read_workbook, share_dictionaries
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # pyarrow is optional, without it the Excel file is always parsed
+    pa = None
+    feather = None
+
+logger = logging.getLogger(__name__)
+
+
+# Columnar snapshot of the Excel file =========================================
+# =============================================================================
+# Parsing the Excel file (XML inside a zip) is by far the slowest part of loading the data
+# At ingest time the parsed DataFrame is written once as an uncompressed Arrow IPC (Feather v2) file
+# The snapshot file name is the content hash of the Excel file, so a changed Excel file never matches an old snapshot
+# Uncompressed Arrow files can be memory mapped, loading them is mostly mapping the column buffers
+# If the snapshot is missing or stale, the Excel file is parsed and a new snapshot is written
+# Bump SNAPSHOT_FORMAT when read_workbook() changes the shape or dtypes of the DataFrame
+
+SNAPSHOT_FORMAT = 2
+SNAPSHOT_SUFFIX = ".arrow"
+
+
+def snapshot_dir(source_path):
+    return os.path.join(os.path.dirname(os.path.abspath(source_path)), ".snapshots")
+
+
+def snapshot_path(source_path, version):
+    name = f"{os.path.basename(source_path)}-{version}-v{SNAPSHOT_FORMAT}{SNAPSHOT_SUFFIX}"
+    return os.path.join(snapshot_dir(source_path), name)
+
+
+# Write the DataFrame as an Arrow IPC file
+# The file is written next to its final name and then renamed, so readers never see a half written snapshot
+def write_snapshot(df, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        feather.write_feather(table, tmp_path, compression="uncompressed")
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# Read an Arrow IPC file with memory mapping
+# The pandas metadata stored in the file restores the original dtypes (string, Float64, Int64, category, ...)
+def read_snapshot(path):
+    return share_dictionaries(feather.read_table(path, memory_map=True).to_pandas())
+
+
+# Remove snapshots of older versions of the same Excel file
+def remove_stale_snapshots(source_path, keep):
+    directory = snapshot_dir(source_path)
+    prefix = f"{os.path.basename(source_path)}-"
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.startswith(prefix) and name.endswith(SNAPSHOT_SUFFIX) and path != keep:
+            os.remove(path)
+
+
+# Reader used by the DatasetStore
+# Use the snapshot when it matches the current file content, otherwise fall back to the Excel file
+# A snapshot that cannot be read or written is only logged, the data is still served from the Excel file
+def load_workbook(source_path, version=None):
+    if feather is None:
+        return read_workbook(source_path)
+
+    if version is None:
+        version = file_hash(source_path)
+    path = snapshot_path(source_path, version)
+
+    if os.path.exists(path):
+        try:
+            return read_snapshot(path)
+        except Exception:
+            logger.warning("Could not read snapshot %s, reading the Excel file instead", path, exc_info=True)
+
+    df = read_workbook(source_path)
+    try:
+        write_snapshot(df, path)
+        remove_stale_snapshots(source_path, keep=path)
+    except Exception:
+        logger.warning("Could not write snapshot %s", path, exc_info=True)
+    return df
+
+
+# Ingest step =========================================
+# =====================================================
+# Compile the snapshot ahead of time, e.g. after uploading a new Excel file:
+#   python -m app.snapshot uploads/TestData.xlsx
+def build_snapshot(source_path):
+    if feather is None:
+        raise RuntimeError("pyarrow is required to build snapshots")
+    version = file_hash(source_path)
+    path = snapshot_path(source_path, version)
+    write_snapshot(read_workbook(source_path), path)
+    remove_stale_snapshots(source_path, keep=path)
+    return path
+
+
+if __name__ == "__main__":
+    from .main import FILE_PATH
+
+    for source in sys.argv[1:] or [FILE_PATH]:
+        print(build_snapshot(source))
@@ -0,0 +1,412 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from .aggregates import ImpactMatrix, Leaderboard, build_group_aggregates
+from .encoding import JSON, RowBytes
+from .impacts import ImpactRegistry
+from .indexes import (
+    NGramIndex,
+    PrefixIndex,
+    build_value_index,
+    duplicate_keys,
+    lookup,
+    normalize_cas,
+    normalize_key,
+)
+from .search import CountryMatcher, FullTextIndex
+from .xlsx_reader import read_xlsx
+
+logger = logging.getLogger(__name__)
+
+
+# Dataset store =========================================
+# =====================================================
+# The Excel file is parsed once and the result is shared by every request
+# A Dataset is never modified after it is created, routes must treat the DataFrame as read-only
+# On every access the file is checked with os.stat() (mtime + size), which is cheap
+# Only when the stat changes the file content is hashed, and only when the hash changes the file is parsed again
+# The new Dataset replaces the old one in a single assignment, so a request always sees one full version
+
+
+# Read the Excel file into a DataFrame
+# =====================================================
+# Here we are using the openpyxl engine to read the Excel file
+# This is because the default engine (xlrd) does not support the latest Excel file format
+# The convert_dtypes() method is used to convert mixed data types to a single data type
+# This is useful for columns with mixed data types (e.g., float and int)
+# The RAND() values are replaced with fixed values to ensure consistent results
+# engine="stream" uses the streaming reader in app/xlsx_reader.py instead of openpyxl
+# The default engine can be changed with the DATASET_ENGINE environment variable
+
+ENGINES = ("openpyxl", "stream")
+DEFAULT_ENGINE = os.environ.get("DATASET_ENGINE", "openpyxl")
+
+
+def read_workbook(path, engine=None):
+    engine = engine or DEFAULT_ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine '{engine}', expected one of {ENGINES}")
+
+    if engine == "stream":
+        # Parse the sheet XML directly into column arrays
+        df = read_xlsx(path)
+    else:
+        # Load the Excel file using the openpyxl engine
+        df = pd.read_excel(path, sheet_name=0, engine="openpyxl")
+
+    # Use strip() to remove leading/trailing or whitespaces from column names
+    df.columns = df.columns.str.strip()
+
+    # Converts mixed types (e.g., float/int)
+    df = df.convert_dtypes()
+
+    # Replace RAND() values with a fixed snapshot
+    for col in df.columns:
+        if df[col].dtype == 'float64':  # Check numeric columns
+            df[col] = df[col].astype(float)  # Force evaluation
+
+    # Store repeated text as categories (integer codes + one dictionary)
+    return encode_categoricals(df)
+
+
+# Dictionary-encode repeated string columns =========================================
+# ===================================================================================
+# Columns like country, type or the data quality texts repeat a few hundred values over all rows
+# As "string" dtype every row keeps its own Python string, as "category" every row keeps a small integer code
+# A text column is encoded when it has at most max_unique_ratio unique values per row
+# Columns that share any value get one shared dictionary (one CategoricalDtype, one categories Index)
+# so equal text has the same code in every column of the group
+# Missing values stay missing (code -1)
+# Text columns of the streaming reader are categoricals already (see read_xlsx()), they are regrouped from their
+# categories without building the strings of every row, and turned into "string" columns if they have too many
+# unique values, so both engines return the same DataFrame
+
+def encode_categoricals(df, max_unique_ratio=0.5):
+    n_rows = len(df)
+    if n_rows == 0:
+        return df
+
+    values = {}
+    encoded = {}
+    for col in df.columns:
+        dtype = df[col].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            if dtype.categories.inferred_type != "string":
+                continue
+            unique = dtype.categories
+            if len(unique) <= max_unique_ratio * n_rows:
+                values[col] = set(unique)
+            else:
+                encoded[col] = df[col].astype("string")
+        elif pd.api.types.is_string_dtype(dtype):
+            unique = df[col].dropna().unique()
+            if len(unique) <= max_unique_ratio * n_rows and all(isinstance(v, str) for v in unique):
+                values[col] = set(unique)
+
+    # Group columns that share at least one value (union-find over the value -> column mapping)
+    parent = {col: col for col in values}
+
+    def find(col):
+        while parent[col] != col:
+            parent[col] = parent[parent[col]]
+            col = parent[col]
+        return col
+
+    owner = {}
+    for col, unique in values.items():
+        for value in unique:
+            other = owner.setdefault(value, col)
+            if other != col:
+                parent[find(col)] = find(other)
+
+    groups = {}
+    for col in values:
+        groups.setdefault(find(col), []).append(col)
+
+    for columns in groups.values():
+        categories = sorted(set().union(*(values[col] for col in columns)))
+        dtype = pd.CategoricalDtype(pd.Index(categories, dtype=object))
+        for col in columns:
+            series = df[col]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                # Recode on the integer codes, the trailing -1 keeps missing values missing
+                lookup = np.append(dtype.categories.get_indexer(series.cat.categories), -1)
+                encoded[col] = pd.Categorical.from_codes(lookup[series.cat.codes.to_numpy()], dtype=dtype)
+            else:
+                encoded[col] = series.astype(object).astype(dtype)
+
+    return df.assign(**encoded) if encoded else df
+
+
+# Make category columns with the same dictionary share one categories Index again
+# Used after reading a snapshot, where every column comes back with its own copy of the dictionary
+def share_dictionaries(df):
+    shared = {}
+    encoded = {}
+    for col in df.columns:
+        dtype = df[col].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            first = shared.setdefault(tuple(dtype.categories), dtype)
+            if first.categories is not dtype.categories:
+                encoded[col] = pd.Categorical.from_codes(df[col].cat.codes, dtype=first)
+    return df.assign(**encoded) if encoded else df
+
+
+# Hash the file content in chunks so large workbooks are not read into memory at once
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _file_stat(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+COUNTRY_CODE = "ISOTwoLetterCountryCode"
+COUNTRY_NAME = "country"
+PROCESS_NAME = "processName"
+UUID = "internalUUID"
+CAS = "CAS"
+GWP_INDICATOR = "GWP100"
+FULLTEXT_COLUMNS = ("processName", "flowName", "processDescription")
+
+
+# One loaded version of the dataset
+# version is the content hash of the source file and can be used as a cache key
+# Indexes are cached properties, warm() builds all of them before the dataset is handed out
+# An index is None when its column is missing from the file
+class Dataset:
+    INDEXES = (
+        "country_index",
+        "country_name_index",
+        "country_matcher",
+        "process_index",
+        "process_names",
+        "process_name_grams",
+        "fulltext_index",
+        "uuid_index",
+        "cas_index",
+        "impacts",
+        "impact_matrix",
+        "country_gwp",
+        "country_leaderboard",
+        "row_json",
+    )
+
+    def __init__(self, df, version):
+        self.df = df
+        self.version = version
+        self.duplicate_uuids = []
+        # Compiled /data/query plans by query text (see app/query.py)
+        self.query_plans = OrderedDict()
+        # Encoded rows by media type, see row_bytes()
+        self._row_bytes = {}
+
+    def warm(self):
+        for name in self.INDEXES:
+            getattr(self, name)
+        return self
+
+    # Return the given row positions as a DataFrame, only the given columns if columns is set
+    def rows(self, positions, columns=None):
+        if columns is None:
+            return self.df.take(positions)
+        return self.df.iloc[positions, self.df.columns.get_indexer(columns)]
+
+    # Normalized ISO country code -> row positions
+    @cached_property
+    def country_index(self):
+        if COUNTRY_CODE not in self.df.columns:
+            return None
+        return build_value_index(self.df[COUNTRY_CODE])
+
+    def country_rows(self, country_code):
+        return lookup(self.country_index, country_code)
+
+    # Normalized country name -> row positions
+    @cached_property
+    def country_name_index(self):
+        if COUNTRY_NAME not in self.df.columns:
+            return None
+        return build_value_index(self.df[COUNTRY_NAME])
+
+    def country_name_rows(self, country):
+        return lookup(self.country_name_index, country)
+
+    # Fuzzy matcher over the distinct (country name, ISO code) pairs
+    @cached_property
+    def country_matcher(self):
+        if COUNTRY_NAME not in self.df.columns or COUNTRY_CODE not in self.df.columns:
+            return None
+        pairs = self.df[[COUNTRY_NAME, COUNTRY_CODE]].dropna().drop_duplicates()
+        return CountryMatcher([(str(name), str(code)) for name, code in pairs.itertuples(index=False)])
+
+    # Normalized (case-insensitive) process name -> row positions
+    @cached_property
+    def process_index(self):
+        if PROCESS_NAME not in self.df.columns:
+            return None
+        return build_value_index(self.df[PROCESS_NAME])
+
+    def process_rows(self, process_name):
+        return lookup(self.process_index, process_name)
+
+    # Distinct process names, searchable by prefix
+    @cached_property
+    def process_names(self):
+        if PROCESS_NAME not in self.df.columns:
+            return None
+        return PrefixIndex(self.df[PROCESS_NAME].dropna().unique().tolist())
+
+    # Distinct process names, searchable by substring
+    @cached_property
+    def process_name_grams(self):
+        if self.process_names is None:
+            return None
+        return NGramIndex(self.process_names.values)
+
+    # internalUUID -> row positions
+    # internalUUID should be unique, duplicates are logged and kept in duplicate_uuids
+    @cached_property
+    def uuid_index(self):
+        if UUID not in self.df.columns:
+            return None
+        index = build_value_index(self.df[UUID])
+        self.duplicate_uuids = duplicate_keys(index)
+        if self.duplicate_uuids:
+            logger.warning(
+                "Dataset %s has %d duplicated %s values, e.g. %s",
+                self.version, len(self.duplicate_uuids), UUID, self.duplicate_uuids[0],
+            )
+        return index
+
+    def uuid_rows(self, uuid):
+        return lookup(self.uuid_index, uuid)
+
+    # Normalized CAS number -> row positions (one CAS usually has a row per country)
+    @cached_property
+    def cas_index(self):
+        if CAS not in self.df.columns:
+            return None
+        return build_value_index(self.df[CAS], normalize=normalize_cas)
+
+    def cas_rows(self, cas):
+        return lookup(self.cas_index, cas, normalize=normalize_cas)
+
+    # Impact categories parsed from the column headers (see app/impacts.py)
+    @cached_property
+    def impacts(self):
+        return ImpactRegistry(
+            self.df.columns, is_numeric=lambda col: pd.api.types.is_numeric_dtype(self.df[col].dtype)
+        )
+
+    # The GWP100 impact columns of the default impact method, in column order
+    @property
+    def gwp_columns(self):
+        return [impact.column for impact in self.impacts.with_indicator(GWP_INDICATOR)]
+
+    # All impact columns as one float64 matrix, rows grouped by country, with prefix sums
+    @cached_property
+    def impact_matrix(self):
+        if COUNTRY_CODE not in self.df.columns:
+            return None
+        return ImpactMatrix(self.df, self.impacts.impacts, COUNTRY_CODE, normalize_key)
+
+    # Normalized ISO country code -> GWP aggregates of the country (see app/aggregates.py)
+    @cached_property
+    def country_gwp(self):
+        if self.impact_matrix is None or COUNTRY_NAME not in self.df.columns or not self.gwp_columns:
+            return None
+        return build_group_aggregates(self.impact_matrix, self.df, COUNTRY_CODE, COUNTRY_NAME, self.gwp_columns)
+
+    # All countries ranked by their GWP aggregates
+    @cached_property
+    def country_leaderboard(self):
+        if self.country_gwp is None:
+            return None
+        return Leaderboard(self.country_gwp)
+
+    # The JSON bytes of every row (see app/encoding.py), None if the rows cannot be encoded
+    # The row id of a row is its position, so the DataFrame must have the default index
+    @cached_property
+    def row_json(self):
+        return self.encode_rows(JSON)
+
+    # The encoded rows for a response encoding, JSON is built by warm(), the others the first time they are used
+    def row_bytes(self, encoding):
+        if encoding is JSON:
+            return self.row_json
+        if encoding.media_type not in self._row_bytes:
+            self._row_bytes[encoding.media_type] = self.encode_rows(encoding)
+        return self._row_bytes[encoding.media_type]
+
+    def encode_rows(self, encoding):
+        if not self.df.index.equals(pd.RangeIndex(len(self.df))):
+            return None
+        try:
+            return RowBytes(self.df, encoding)
+        except (TypeError, ValueError):
+            logger.exception("Could not encode the rows of dataset %s as %s", self.version, encoding.media_type)
+            return None
+
+    # BM25 index over the text of FULLTEXT_COLUMNS, one document per row
+    @cached_property
+    def fulltext_index(self):
+        columns = [col for col in FULLTEXT_COLUMNS if col in self.df.columns]
+        if not columns:
+            return None
+        text = self.df[columns].astype(object)
+        text = text.where(text.notna(), "")
+        documents = [" ".join(map(str, values)) for values in text.itertuples(index=False)]
+        return FullTextIndex(documents)
+
+
+# reader(path, version) returns the DataFrame for the given file content hash, without a reader the Excel file is parsed
+class DatasetStore:
+    def __init__(self, path, reader=None):
+        self.path = path
+        self.reader = reader
+        self._lock = threading.Lock()
+        # (file stat, Dataset) is swapped as one tuple so readers never see a mixed state
+        self._state = None
+
+    # Return the current Dataset, reloading it first if the file has changed
+    # Raises FileNotFoundError if the file does not exist
+    def get(self):
+        stat = _file_stat(self.path)
+        state = self._state
+        if state is not None and state[0] == stat:
+            return state[1]
+
+        # Only one thread reloads, the others wait and then reuse its result
+        with self._lock:
+            state = self._state
+            if state is not None and state[0] == stat:
+                return state[1]
+
+            version = file_hash(self.path)
+            if state is not None and state[1].version == version:
+                # File was touched but the content is the same
+                self._state = (stat, state[1])
+                return state[1]
+
+            df = read_workbook(self.path) if self.reader is None else self.reader(self.path, version)
+            dataset = Dataset(df, version).warm()
+            self._state = (stat, dataset)
+            return dataset
+
+    # Drop the loaded dataset, the next get() parses the file again
+    def clear(self):
+        with self._lock:
+            self._state = None
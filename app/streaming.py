@@ -0,0 +1,32 @@
+from fastapi.encoders import jsonable_encoder
+
+from .encoding import JSON
+
+
+# Streaming responses =========================================
+# =============================================================
+# Large results are encoded in chunks of rows and sent with a StreamingResponse
+# Only one chunk of rows is turned into Python dicts at a time, so the memory of a request does not grow
+# with the size of the result and the first bytes are sent before the last rows are encoded
+# If the rows are already encoded (see RowBytes in app/encoding.py) their cached bytes are streamed instead
+
+STREAM_CHUNK_ROWS = 500
+
+
+# The given rows and columns (all columns if columns is None) of the dataset as an array of objects (JSON by default)
+# Every chunk of rows is taken from the dataset only when it is encoded
+def iter_records(dataset, positions, columns=None, encoding=JSON, chunk_rows=STREAM_CHUNK_ROWS):
+    def chunks():
+        for start in range(0, len(positions), chunk_rows):
+            rows = dataset.rows(positions[start:start + chunk_rows], columns)
+            yield [encoding.encode(record) for record in jsonable_encoder(rows.to_dict(orient="records"))]
+    return encoding.iter_array(len(positions), chunks())
+
+
+# An object with the fields of document, the value of records_key is replaced by the chunks of records
+def iter_document(document, records_key, records, encoding=JSON):
+    fields = [
+        (key, records if key == records_key else [encoding.encode(jsonable_encoder(value))])
+        for key, value in document.items()
+    ]
+    return encoding.iter_map(fields)
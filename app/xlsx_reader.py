@@ -0,0 +1,297 @@
+import posixpath
+import re
+import zipfile
+from array import array
+from xml.etree.ElementTree import iterparse
+
+import numpy as np
+import pandas as pd
+
+
+# Streaming XLSX reader =========================================
+# ===============================================================
+# openpyxl builds a Python Cell object for every cell and keeps the whole sheet in memory
+# This reader parses the XML files inside the .xlsx zip incrementally with iterparse instead
+# Elements are cleared as soon as they are read, so memory stays flat while the sheet is parsed
+# Shared strings (xl/sharedStrings.xml) are read once into a list, string cells only keep the index into that list
+# Each column is collected into a typed array: float64 for numbers, int32 string codes for text
+# Only columns that mix numbers and text fall back to Python objects
+# The first row is used as the header, the same as pd.read_excel(..., header=0)
+
+NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+# Built-in number formats that Excel shows as dates or times
+DATE_FORMAT_IDS = set(range(14, 23)) | {45, 46, 47}
+EXCEL_EPOCH = pd.Timestamp("1899-12-30")
+
+_CELL_REF = re.compile(r"([A-Z]+)(\d+)")
+_DATE_TOKENS = re.compile(r"[dmyhs]", re.IGNORECASE)
+_FORMAT_LITERALS = re.compile(r'"[^"]*"|\[[^\]]*\]|\\.')
+
+
+def column_index(letters):
+    index = 0
+    for ch in letters:
+        index = index * 26 + (ord(ch) - 64)
+    return index - 1
+
+
+# Join the text of a <si> or <is> element, including rich text runs but not phonetic hints
+def _element_text(element):
+    parts = []
+    for child in element.iter():
+        if child.tag == NS + "t":
+            parts.append(child.text or "")
+        elif child.tag == NS + "rPh":
+            break
+    return "".join(parts)
+
+
+def read_shared_strings(zf, path="xl/sharedStrings.xml"):
+    if path not in zf.namelist():
+        return []
+    strings = []
+    with zf.open(path) as f:
+        for _, element in iterparse(f):
+            if element.tag == NS + "si":
+                strings.append(_element_text(element))
+                element.clear()
+    return strings
+
+
+# Style index -> True if the cell number format is a date format
+def read_date_styles(zf, path="xl/styles.xml"):
+    if path not in zf.namelist():
+        return []
+    custom_formats = {}
+    date_styles = []
+    with zf.open(path) as f:
+        in_cell_xfs = False
+        for event, element in iterparse(f, events=("start", "end")):
+            if element.tag == NS + "cellXfs":
+                in_cell_xfs = event == "start"
+            elif event == "end" and element.tag == NS + "numFmt":
+                custom_formats[int(element.get("numFmtId"))] = element.get("formatCode", "")
+            elif event == "end" and element.tag == NS + "xf" and in_cell_xfs:
+                fmt_id = int(element.get("numFmtId", 0))
+                if fmt_id in custom_formats:
+                    code = _FORMAT_LITERALS.sub("", custom_formats[fmt_id])
+                    date_styles.append(bool(_DATE_TOKENS.search(code)))
+                else:
+                    date_styles.append(fmt_id in DATE_FORMAT_IDS)
+    return date_styles
+
+
+# Path of the first worksheet, resolved through the workbook relationships
+def first_sheet_path(zf):
+    with zf.open("xl/workbook.xml") as f:
+        for _, element in iterparse(f):
+            if element.tag == NS + "sheet":
+                rel_id = element.get(REL_NS + "id")
+                break
+        else:
+            raise ValueError("Workbook has no sheets")
+    with zf.open("xl/_rels/workbook.xml.rels") as f:
+        for _, element in iterparse(f):
+            if element.tag == PKG_REL_NS + "Relationship" and element.get("Id") == rel_id:
+                target = element.get("Target")
+                if target.startswith("/"):
+                    return target.lstrip("/")
+                return posixpath.normpath(posixpath.join("xl", target))
+    raise ValueError(f"Worksheet relationship {rel_id} not found")
+
+
+# One column of the sheet, filled row by row
+# kind is None (only empty cells so far), "num", "str" or "obj"
+class _Column:
+    def __init__(self):
+        self.kind = None
+        self.data = None
+        self.is_date = False
+        self.length = 0
+
+    def _switch_to_objects(self, strings):
+        if self.kind == "num":
+            self.data = list(self.data)
+        elif self.kind == "str":
+            self.data = [np.nan if c < 0 else strings[c] for c in self.data]
+        else:
+            self.data = [np.nan] * self.length
+        self.kind = "obj"
+
+    def _pad(self, row):
+        missing = row - self.length
+        if missing > 0:
+            if self.kind == "num":
+                self.data.extend([np.nan] * missing)
+            elif self.kind == "str":
+                self.data.extend([-1] * missing)
+            elif self.kind == "obj":
+                self.data.extend([np.nan] * missing)
+            self.length = row
+
+    def add_number(self, row, value, strings):
+        if self.kind is None:
+            self.kind = "num"
+            self.data = array("d", [np.nan] * self.length)
+        elif self.kind == "str":
+            self._switch_to_objects(strings)
+        self._pad(row)
+        self.data.append(value)
+        self.length += 1
+
+    def add_code(self, row, code, strings):
+        if self.kind is None:
+            self.kind = "str"
+            self.data = array("i", [-1] * self.length)
+        elif self.kind == "num":
+            self._switch_to_objects(strings)
+        self._pad(row)
+        self.data.append(code if self.kind == "str" else strings[code])
+        self.length += 1
+
+    def add_object(self, row, value, strings):
+        if self.kind != "obj":
+            self._switch_to_objects(strings)
+        self._pad(row)
+        self.data.append(value)
+        self.length += 1
+
+    def to_array(self, n_rows, strings):
+        self._pad(n_rows)
+        if self.kind == "num":
+            values = np.frombuffer(self.data, dtype=np.float64)
+            if self.is_date:
+                return (EXCEL_EPOCH + pd.to_timedelta(values, unit="D")).round("ms").to_numpy()
+            return values
+        if self.kind == "str":
+            return np.frombuffer(self.data, dtype=np.int32)
+        if self.kind == "obj":
+            return np.array(self.data, dtype=object)
+        return np.full(n_rows, np.nan)
+
+
+def _unique_headers(headers):
+    seen = {}
+    result = []
+    for name in headers:
+        name = "Unnamed: %d" % len(result) if name is None else str(name)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        result.append(name)
+    return result
+
+
+# Parse the first sheet of the workbook into typed column arrays
+# Returns (names, arrays, is_code, strings), is_code marks the int32 code columns (-1 = empty cell)
+# strings is the shared strings table, extended with inline strings found in the sheet
+def read_columns(path):
+    with zipfile.ZipFile(path) as zf:
+        strings = read_shared_strings(zf)
+        date_styles = read_date_styles(zf)
+        sheet = first_sheet_path(zf)
+
+        inline_codes = {}
+        headers = {}
+        columns = {}
+        row = -1
+        next_col = 0
+
+        with zf.open(sheet) as f:
+            for event, element in iterparse(f, events=("start", "end")):
+                tag = element.tag
+                if event == "start":
+                    if tag == NS + "row":
+                        r = element.get("r")
+                        row = int(r) - 1 if r else row + 1
+                        next_col = 0
+                    continue
+
+                if tag == NS + "row":
+                    element.clear()
+                    continue
+                if tag != NS + "c":
+                    continue
+
+                ref = element.get("r")
+                col = column_index(_CELL_REF.match(ref).group(1)) if ref else next_col
+                next_col = col + 1
+                cell_type = element.get("t", "n")
+                style = int(element.get("s", 0))
+                if cell_type == "inlineStr":
+                    is_element = element.find(NS + "is")
+                    text = _element_text(is_element) if is_element is not None else None
+                else:
+                    v = element.find(NS + "v")
+                    text = v.text if v is not None else None
+                element.clear()
+
+                if text is None:
+                    continue
+
+                if row == 0:
+                    headers[col] = strings[int(text)] if cell_type == "s" else text
+                    continue
+
+                column = columns.get(col)
+                if column is None:
+                    column = columns[col] = _Column()
+                data_row = row - 1
+
+                if cell_type == "s":
+                    column.add_code(data_row, int(text), strings)
+                elif cell_type in ("str", "inlineStr"):
+                    code = inline_codes.get(text)
+                    if code is None:
+                        code = inline_codes[text] = len(strings)
+                        strings.append(text)
+                    column.add_code(data_row, code, strings)
+                elif cell_type == "b":
+                    column.add_object(data_row, text == "1", strings)
+                elif cell_type == "e":
+                    column.add_number(data_row, np.nan, strings)
+                else:
+                    if style < len(date_styles) and date_styles[style]:
+                        column.is_date = True
+                    column.add_number(data_row, float(text), strings)
+
+    n_rows = max((c.length for c in columns.values()), default=0)
+    n_cols = max(list(headers) + list(columns), default=-1) + 1
+    names = _unique_headers([headers.get(i) for i in range(n_cols)])
+    arrays = []
+    is_code = []
+    for i in range(n_cols):
+        column = columns.get(i) or _Column()
+        arrays.append(column.to_array(n_rows, strings))
+        is_code.append(column.kind == "str")
+    return names, arrays, is_code, strings
+
+
+# Categorical column from the string codes of a column, only the strings the column uses become categories
+# The same text can have two codes (shared string and inline string), equal categories are merged
+# Code -1 (empty cell) stays a missing value
+def _categorical(codes, table):
+    used, inverse = np.unique(codes, return_inverse=True)
+    valid = used >= 0
+    remap, categories = pd.factorize(table[used[valid]])
+    lookup = np.full(len(used), -1, dtype=np.int64)
+    lookup[valid] = remap
+    return pd.Categorical.from_codes(lookup[inverse], categories=pd.Index(categories, dtype=object))
+
+
+# Replacement for pd.read_excel(path, sheet_name=0)
+# Text columns are returned as categoricals built from the string codes, no Python string is created per cell
+# (read_workbook() turns them into shared dictionaries or back into text, see encode_categoricals() in app/store.py)
+def read_xlsx(path):
+    names, arrays, is_code, strings = read_columns(path)
+    table = np.array(strings, dtype=object)
+    data = {
+        name: _categorical(values, table) if coded else values
+        for name, values, coded in zip(names, arrays, is_code)
+    }
+    return pd.DataFrame(data, columns=names)
@@ -0,0 +1,36 @@
+import os
+import sys
+import timeit
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.main import FILE_PATH  # noqa: E402
+from app.store import ENGINES, read_workbook  # noqa: E402
+
+
+# Benchmark the Excel engines =========================================
+# =====================================================================
+# Compares read_workbook() with the openpyxl engine and the streaming reader
+# Both engines must produce the same DataFrame, otherwise the benchmark stops
+# Usage: python benchmarks/bench_load.py [path/to/file.xlsx] [repeat]
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else FILE_PATH
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    frames = {engine: read_workbook(path, engine=engine) for engine in ENGINES}
+    pd.testing.assert_frame_equal(frames["openpyxl"], frames["stream"])
+
+    results = {}
+    for engine in ENGINES:
+        times = timeit.repeat(lambda: read_workbook(path, engine=engine), number=1, repeat=repeat)
+        results[engine] = min(times)
+        print(f"{engine:>10}: best {min(times) * 1000:8.1f} ms of {repeat} runs")
+
+    print(f"   speedup: {results['openpyxl'] / results['stream']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -56,3 +56,502 @@ def test_get_data_by_country(mock_load):
     assert isinstance(json_data, list)
     assert len(json_data) > 0  
     assert all(item["ISOTwoLetterCountryCode"] == "DE" for item in json_data)  
+
+
+
+
+# Test that the dataset is parsed once and shared between requests
+def test_dataset_is_cached():
+    from server3.app.main import store
+
+    first = store.get()
+    client.get("/data/country/US")
+    assert store.get() is first
+
+
+
+
+# Test that the streaming Excel reader returns the same data as openpyxl
+def test_stream_engine_matches_openpyxl():
+    from server3.app.main import FILE_PATH
+    from server3.app.store import read_workbook
+
+    expected = read_workbook(FILE_PATH, engine="openpyxl")
+    actual = read_workbook(FILE_PATH, engine="stream")
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+
+
+
+# Test the Arrow snapshot is written once, read back unchanged, and replaced if it is stale or corrupt
+def test_workbook_snapshot(tmp_path):
+    import os
+    import shutil
+    from server3.app.main import FILE_PATH
+    from server3.app.snapshot import load_workbook, snapshot_dir, snapshot_path
+    from server3.app.store import file_hash, read_workbook
+
+    source = str(tmp_path / "TestData.xlsx")
+    shutil.copy(FILE_PATH, source)
+    expected = read_workbook(source)
+    path = snapshot_path(source, file_hash(source))
+
+    # Snapshot of an older version of the file
+    stale = snapshot_path(source, "0" * 64)
+    os.makedirs(snapshot_dir(source))
+    with open(stale, "wb") as f:
+        f.write(b"old")
+
+    pd.testing.assert_frame_equal(load_workbook(source), expected)
+    assert os.path.exists(path)
+    assert not os.path.exists(stale)
+
+    with patch("server3.app.snapshot.read_workbook") as parse:
+        pd.testing.assert_frame_equal(load_workbook(source), expected)
+    parse.assert_not_called()
+
+    with open(path, "wb") as f:
+        f.write(b"not an arrow file")
+    pd.testing.assert_frame_equal(load_workbook(source), expected)
+    with patch("server3.app.snapshot.read_workbook") as parse:
+        load_workbook(source)
+    parse.assert_not_called()
+
+
+
+
+
+# Test repeated text gets one shared dictionary per group of columns, also after a snapshot round-trip
+def test_shared_dictionaries(tmp_path):
+    from server3.app.snapshot import read_snapshot, write_snapshot
+    from server3.app.store import encode_categoricals
+
+    df = pd.DataFrame({
+        "from": pd.array(["DE", "FR", "DE", None, "DE", "FR"], dtype="string"),
+        "to": pd.array(["FR", "IT", "FR", "FR", "IT", "IT"], dtype="string"),
+        "unit": pd.array(["kg"] * 6, dtype="string"),
+        "id": pd.array(["a", "b", "c", "d", "e", "f"], dtype="string"),
+        "value": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+    })
+    encoded = encode_categoricals(df)
+
+    assert encoded["from"].dtype.categories is encoded["to"].dtype.categories
+    assert list(encoded["from"].cat.categories) == ["DE", "FR", "IT"]
+    assert encoded["from"].cat.codes.tolist() == [0, 1, 0, -1, 0, 1]
+    assert list(encoded["unit"].cat.categories) == ["kg"]
+    assert encoded["id"].dtype == "string"
+    for col in ("from", "to", "unit"):
+        pd.testing.assert_series_equal(encoded[col].astype("string"), df[col])
+
+    path = str(tmp_path / "snapshot.arrow")
+    write_snapshot(encoded, path)
+    restored = read_snapshot(path)
+
+    pd.testing.assert_frame_equal(restored, encoded)
+    assert restored["from"].dtype.categories is restored["to"].dtype.categories
+
+
+
+
+# Test the GET /data/process_names/search endpoint with a limit
+def test_process_names_prefix_search():
+    response = client.get("/data/process_names/search", params={"query": "REACTION", "limit": 2})
+
+    assert response.status_code == 200
+    names = response.json()["process_names"]
+    assert len(names) == 2
+    assert names == sorted(names)
+    assert all(name.lower().startswith("reaction") for name in names)
+
+
+
+
+# Test the GET /data/process_names/search endpoint in contains mode
+def test_process_names_contains_search():
+    response = client.get("/data/process_names/search", params={"query": "chlor", "mode": "contains"})
+
+    assert response.status_code == 200
+    names = response.json()["process_names"]
+    assert len(names) > 0
+    assert all("chlor" in name.lower() for name in names)
+
+
+
+
+# Test the GET /data/fulltext endpoint
+def test_fulltext_search():
+    response = client.get("/data/fulltext", params={"q": "benzene chlorine", "limit": 5})
+
+    assert response.status_code == 200
+    json_data = response.json()
+    assert json_data["total"] > 0
+    assert len(json_data["results"]) <= 5
+    scores = [item["score"] for item in json_data["results"]]
+    assert scores == sorted(scores, reverse=True)
+
+
+
+
+# Test fuzzy country matching in the GET /data/search endpoint
+def test_search_data_fuzzy_country():
+    # One typo is resolved to the country, the resolved country is sent in the headers
+    for query, code in (("Netherland", "NL"), ("Germny", "DE"), ("Grmany", "DE"), ("Frnce", "FR"), ("Untied States", "US")):
+        response = client.get("/data/search", params={"query": query})
+
+        assert response.status_code == 200
+        assert response.headers["x-resolved-country-code"] == code
+        assert all(item["ISOTwoLetterCountryCode"] == code for item in response.json())
+
+    # Not close enough to resolve: Peru is not in the dataset and must not return Iran (alias "persia")
+    for query in ("Peru", "Chile"):
+        response = client.get("/data/search", params={"query": query})
+        assert response.status_code == 404
+        assert "suggestions" in response.json()["detail"]
+
+    response = client.get("/data/search", params={"query": "Chile"})
+    assert response.json()["detail"]["suggestions"][0]["ISOTwoLetterCountryCode"] == "CN"
+
+    response = client.get("/data/search/countries", params={"query": "United States of America"})
+
+    assert response.status_code == 200
+    assert response.json()[0]["ISOTwoLetterCountryCode"] == "US"
+
+
+
+
+# Test the GET /data/uuid/{uuid} and GET /data/cas/{cas} endpoints
+def test_get_data_by_uuid_and_cas():
+    response = client.get("/data/uuid/3978562e-a1e7-4ace-a199-031576d88e14")
+
+    assert response.status_code == 200
+    assert response.json()["internalUUID"] == "3978562e-a1e7-4ace-a199-031576d88e14"
+
+    response = client.get("/data/cas/000101815")
+
+    assert response.status_code == 200
+    assert all(item["CAS"] == "101-81-5" for item in response.json())
+
+
+
+
+# Test the GET /data/aggregate leaderboard endpoint
+def test_aggregate_leaderboard():
+    response = client.get("/data/aggregate", params={"sort": "total", "order": "desc", "limit": 5})
+
+    assert response.status_code == 200
+    countries = response.json()["countries"]
+    assert len(countries) == 5
+    totals = [item["total_GWP100"] for item in countries]
+    assert totals == sorted(totals, reverse=True)
+
+
+
+
+
+# Test the GWP aggregates of one country against a direct pandas sum of the GWP100 columns
+def test_gwp_aggregate_by_country():
+    from server3.app.main import FILE_PATH, store
+
+    gwp_columns = [
+        "Carbon Minds ISO 14067 (based on IPCC 2021) - climate change - global warming potential (GWP100) [kg CO2-Eq]",
+        "Carbon Minds ISO 14067 (based on IPCC 2021) - climate change: biogenic emissions - global warming potential (GWP100) [kg CO2-Eq]",
+        "Carbon Minds ISO 14067 (based on IPCC 2021) - climate change: biogenic removal - global warming potential (GWP100) [kg CO2-Eq]",
+        "Carbon Minds ISO 14067 (based on IPCC 2021) - climate change: fossil - global warming potential (GWP100) [kg CO2-Eq]",
+        "Carbon Minds ISO 14067 (based on IPCC 2021) - climate change: land use - global warming potential (GWP100) [kg CO2-Eq]",
+    ]
+    assert store.get().gwp_columns == gwp_columns
+
+    df = pd.read_excel(FILE_PATH, sheet_name=0, engine="openpyxl")
+    df.columns = df.columns.str.strip()
+    country_data = df[df["ISOTwoLetterCountryCode"] == "DE"]
+    sums = country_data[gwp_columns].apply(pd.to_numeric, errors="coerce").fillna(0).astype(float).sum().to_dict()
+
+    response = client.get("/data/gwp/aggregate/de")
+    assert response.status_code == 200
+    assert response.json() == {"country": "Germany", "total_GWP100": round(sum(sums.values()), 2)}
+
+    response = client.get("/data/aggregate/DE")
+    assert response.status_code == 200
+    assert response.json() == {
+        "country": "Germany",
+        "total_GWP100": round(sum(sums.values()), 2),
+        "min_GWP100": round(min(sums.values()), 2),
+        "max_GWP100": round(max(sums.values()), 2),
+        "total_GWP100_by_column": {col: round(value, 2) for col, value in sums.items()},
+    }
+
+
+
+
+# Test the GET /data/stats endpoint
+def test_statistics():
+    response = client.get("/data/stats", params={"stats": "count,mean,median,p90", "columns": "carbonContent"})
+
+    assert response.status_code == 200
+    group = response.json()["groups"][0]
+    assert set(group["columns"]["carbonContent"]) == {"count", "mean", "median", "p90"}
+
+    response = client.get("/data/stats", params={"stats": "unknown"})
+    assert response.status_code == 400
+
+    for stats in ("sum", "sum,min"):
+        response = client.get("/data/stats", params={"stats": stats, "country_code": "XX"})
+        assert response.status_code == 404
+
+    # The fast path (sum from the prefix sums) and the aggregation engine (sum with min) agree up to rounding
+    import pytest
+
+    fast = client.get("/data/stats", params={"stats": "sum", "country_code": "DE"}).json()["groups"][0]["columns"]
+    engine = client.get("/data/stats", params={"stats": "sum,min", "country_code": "DE"}).json()["groups"][0]["columns"]
+    assert {col: values["sum"] for col, values in fast.items()} == pytest.approx(
+        {col: values["sum"] for col, values in engine.items()}
+    )
+
+
+
+
+# Test the GET /schema/impacts endpoint
+def test_impact_schema():
+    response = client.get("/schema/impacts")
+
+    assert response.status_code == 200
+    impacts = {item["id"]: item for item in response.json()["impacts"]}
+    fossil = impacts["climate_change_fossil_gwp100"]
+    assert fossil["category"] == "climate change"
+    assert fossil["sub_category"] == "fossil"
+    assert fossil["unit"] == "kg CO2-Eq"
+
+
+
+
+# Test the ids of the default method do not change when another method is added, and GWP100 only uses the default method
+def test_impact_methods():
+    from server3.app.impacts import DEFAULT_METHOD, ImpactRegistry
+
+    columns = [
+        f"{DEFAULT_METHOD} - climate change - global warming potential (GWP100) [kg CO2-Eq]",
+        f"{DEFAULT_METHOD} - climate change: fossil - global warming potential (GWP100) [kg CO2-Eq]",
+    ]
+    other = "EF v3.1 - climate change - global warming potential (GWP100) [kg CO2-Eq]"
+
+    before = ImpactRegistry(columns)
+    after = ImpactRegistry(columns + [other])
+    assert [impact.id for impact in after.impacts[:2]] == [impact.id for impact in before.impacts]
+    assert after.impacts[2].id == "ef_v3_1_climate_change_gwp100"
+    assert [impact.column for impact in after.with_indicator("GWP100")] == columns
+
+
+
+
+# Test the GET /data/query endpoint
+def test_query_expression():
+    response = client.get("/data/query", params={"q": "ISOTwoLetterCountryCode in ('de', 'FR') and GWP100 >= 0"})
+
+    assert response.status_code == 200
+    assert {item["ISOTwoLetterCountryCode"] for item in response.json()} <= {"DE", "FR"}
+
+    response = client.get("/data/query", params={"q": "unknownColumn = 1"})
+    assert response.status_code == 400
+
+    response = client.get("/data/query", params={"q": "(" * 5000 + "GWP100 > 0" + ")" * 5000})
+    assert response.status_code == 400
+    response = client.get("/data/query", params={"q": "not " * 5000 + "GWP100 > 0"})
+    assert response.status_code == 400
+
+
+
+
+# Test keyset pagination and column projection on the GET /data endpoint
+def test_data_pagination():
+    rows = []
+    cursor = None
+    while True:
+        params = {"limit": 100, "fields": "internalUUID,country"}
+        if cursor is not None:
+            params["cursor"] = cursor
+        response = client.get("/data", params=params)
+        assert response.status_code == 200
+        body = response.json()
+        assert body["headers"] == ["internalUUID", "country"]
+        rows += body["data"]
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+
+    all_rows = client.get("/data").json()["data"]
+    assert [row["internalUUID"] for row in rows] == [row["internalUUID"] for row in all_rows]
+
+    response = client.get("/data/country/DE", params={"limit": 1})
+    assert len(response.json()) == 1
+    assert "x-next-cursor" in response.headers
+
+
+
+
+# Test a cursor after the last matching row returns an empty page (not a 404 or the rows of another match)
+def test_pagination_past_last_row():
+    from server3.app.main import store
+
+    dataset = store.get()
+    last_au_row = int(dataset.country_rows("AU")[-1])
+    for url, params in (("/data/country/AU", {}), ("/data/search", {"query": "AU"})):
+        response = client.get(url, params={**params, "cursor": last_au_row})
+        assert response.status_code == 200
+        assert response.json() == []
+
+    process_name = dataset.df["processName"].iloc[0]
+    response = client.get(f"/data/process/{process_name}", params={"cursor": len(dataset.df)})
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+
+
+# Test the streaming mode (stream=true) sends the same JSON as the normal response
+def test_streaming_response():
+    for url in ("/data", "/data/country/DE"):
+        response = client.get(url)
+        streamed = client.get(url, params={"stream": "true"})
+
+        assert streamed.status_code == 200
+        assert streamed.json() == response.json()
+
+
+
+
+# Test the rows are served from the pre-serialized row cache of the dataset
+def test_row_json_cache():
+    from fastapi.encoders import jsonable_encoder
+    from server3.app.main import store
+
+    dataset = store.get()
+    assert dataset.row_json is not None
+    assert len(dataset.row_json) == len(dataset.df)
+
+    response = client.get("/data/country/DE")
+    expected = dataset.rows(dataset.country_rows("DE")).to_dict(orient="records")
+    assert response.json() == jsonable_encoder(expected)
+
+
+
+
+# Test repeated requests are answered from the response cache
+def test_response_cache():
+    client.get("/data/aggregate", params={"limit": 3})
+    response = client.get("/data/aggregate", params={"limit": 3})
+
+    assert response.status_code == 200
+    assert response.headers["x-cache"] == "HIT"
+    assert client.get("/cache/stats").json()["hits"] >= 1
+
+    from server3.app.cache import CachedResponse, ResponseCache
+
+    cache = ResponseCache(max_bytes=100, max_entry_bytes=100)
+    cache.set_version("v1")
+    cache.put(("v1", "/a", ""), CachedResponse(200, [], b"x" * 60))
+    cache.put(("v1", "/b", ""), CachedResponse(200, [], b"x" * 60))
+    assert cache.get(("v1", "/a", "")) is None
+    assert cache.evictions == 1
+
+    cache.set_version("v2")
+    assert len(cache) == 0
+
+
+
+
+# Test ETag / If-None-Match and dataset-versioned URLs
+def test_conditional_requests():
+    response = client.get("/data/aggregate")
+    etag = response.headers["etag"]
+    version = response.headers["x-dataset-version"]
+
+    response = client.get("/data/aggregate", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    response = client.get(f"/v/{version}/data/aggregate")
+    assert response.status_code == 200
+    assert "immutable" in response.headers["cache-control"]
+
+    assert client.get("/v/0123abcd/data/aggregate").status_code == 404
+
+    # * does not match, the route decides (here a 404 for an unknown country)
+    response = client.get("/data/country/XX", headers={"If-None-Match": "*"})
+    assert response.status_code != 304
+
+    # Excluded paths are not cached behind a versioned URL either
+    hits = client.get(f"/v/{version}/cache/stats").json()["hits"]
+    response = client.get(f"/v/{version}/cache/stats")
+    assert "x-cache" not in response.headers
+    assert response.json()["hits"] == hits
+
+
+
+
+# Test cached responses are sent precompressed when the client accepts it
+def test_precompressed_responses():
+    client.get("/data/country/DE")
+    response = client.get("/data/country/DE", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"].endswith('-gzip"')
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert int(response.headers["content-length"]) < len(response.content)
+    assert response.json()[0]["ISOTwoLetterCountryCode"] == "DE"
+
+    response = client.get("/test/3", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+
+
+
+
+# Test the rows are sent as MessagePack when the Accept header asks for it
+def test_msgpack_response():
+    import msgpack
+
+    expected = client.get("/data/country/DE").json()
+    response = client.get("/data/country/DE", headers={"Accept": "application/msgpack"})
+
+    assert response.headers["content-type"] == "application/msgpack"
+    assert msgpack.unpackb(response.content) == expected
+
+    response = client.get("/data/country/DE", headers={"Accept": "text/html"})
+    assert response.headers["content-type"] == "application/json"
+
+
+
+
+
+# Test CBOR responses decode to the same rows as JSON (arrays and the /data document, also streamed)
+def test_cbor_response():
+    import cbor2
+
+    for url in ("/data/country/DE", "/data"):
+        expected = client.get(url).json()
+        for params in ({}, {"stream": "true"}):
+            response = client.get(url, params=params, headers={"Accept": "application/cbor"})
+
+            assert response.headers["content-type"] == "application/cbor"
+            assert cbor2.loads(response.content) == expected
+
+
+
+
+# Test the Arrow IPC and Parquet export endpoints
+def test_export_arrow_and_parquet():
+    import io
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    response = client.get("/export/arrow", params={"country_code": "DE", "fields": "country,CAS"})
+    assert response.status_code == 200
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.column_names == ["country", "CAS"]
+    assert set(table.column("country").to_pylist()) == {"Germany"}
+
+    response = client.get("/export/parquet", params={"limit": 10})
+    assert response.status_code == 200
+    assert pq.read_table(io.BytesIO(response.content)).num_rows == 10
+    assert "x-next-cursor" in response.headers